@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""Compares the hot lookup queries before and after the index migration.
+
+Seeds a SQLite database with protocols, decisions, documents, errors and
+todos, prints the query plan and the mean duration of every query, then
+applies the migration and repeats the measurement.
+
+    ./benchmark_indexes.py [--protocols 10000]
+"""
+import argparse
+import importlib.util
+import os
+import random
+import time
+from datetime import date, timedelta
+
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import create_engine, text
+
+MIGRATION = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "migrations", "versions", "2e7b9d4c6a13_.py")
+
+SCHEMA = [
+    "CREATE TABLE protocols (id INTEGER PRIMARY KEY, protocoltype_id "
+    "INTEGER, date DATE, done BOOLEAN NOT NULL, content_public TEXT)",
+    "CREATE TABLE todos (id INTEGER PRIMARY KEY, protocoltype_id INTEGER, "
+    "number INTEGER, description TEXT)",
+    "CREATE TABLE decisions (id INTEGER PRIMARY KEY, protocol_id INTEGER, "
+    "content TEXT)",
+    "CREATE TABLE documents (id INTEGER PRIMARY KEY, protocol_id INTEGER, "
+    "name TEXT)",
+    "CREATE TABLE errors (id INTEGER PRIMARY KEY, protocol_id INTEGER, "
+    "name TEXT)",
+    "CREATE TABLE oldtodos (id INTEGER PRIMARY KEY, protocol_key TEXT)",
+    "CREATE TABLE todoprotocolassociations (todo_id INTEGER, protocol_id "
+    "INTEGER, PRIMARY KEY (todo_id, protocol_id))",
+    "CREATE TABLE decisioncategoryassociations (decision_id INTEGER, "
+    "decisioncategory_id INTEGER, PRIMARY KEY (decision_id, "
+    "decisioncategory_id))",
+]
+
+QUERIES = [
+    ("protocols of a type",
+     "SELECT id FROM protocols WHERE protocoltype_id = 3 "
+     "ORDER BY date DESC LIMIT 20"),
+    ("open protocols around today",
+     "SELECT id FROM protocols WHERE done = 0 "
+     "AND date BETWEEN :today AND :later"),
+    ("protocols in date order",
+     "SELECT id FROM protocols ORDER BY date DESC LIMIT 20 OFFSET 200"),
+    ("decisions of a protocol",
+     "SELECT id FROM decisions WHERE protocol_id = :protocol_id"),
+    ("documents of a protocol",
+     "SELECT id FROM documents WHERE protocol_id = :protocol_id"),
+    ("errors of a protocol",
+     "SELECT id FROM errors WHERE protocol_id = :protocol_id"),
+    ("todos of a protocol",
+     "SELECT todo_id FROM todoprotocolassociations "
+     "WHERE protocol_id = :protocol_id"),
+    ("todo by number", "SELECT id FROM todos WHERE number = :number"),
+    ("todos of a type",
+     "SELECT count(*) FROM todos WHERE protocoltype_id = 3"),
+    ("decisions of a category",
+     "SELECT decision_id FROM decisioncategoryassociations "
+     "WHERE decisioncategory_id = 7"),
+    ("old todos of a protocol",
+     "SELECT id FROM oldtodos WHERE protocol_key = :protocol_key"),
+]
+
+
+def seed(connection, protocol_count):
+    random.seed(0)
+    today = date.today()
+    for statement in SCHEMA:
+        connection.execute(text(statement))
+    protocols = [
+        {"id": protocol_id, "protocoltype_id": protocol_id % 20,
+         "date": today - timedelta(
+             days=(protocol_count - protocol_id) // 10),
+         "done": protocol_id < protocol_count - 50,
+         "content": "Protokoll {}".format(protocol_id)}
+        for protocol_id in range(1, protocol_count + 1)
+    ]
+    connection.execute(text(
+        "INSERT INTO protocols VALUES "
+        "(:id, :protocoltype_id, :date, :done, :content)"), protocols)
+    per_protocol = [
+        {"id": protocol_id * 5 + index, "protocol_id": protocol_id}
+        for protocol_id in range(1, protocol_count + 1)
+        for index in range(5)
+    ]
+    for table in ("decisions", "documents", "errors"):
+        connection.execute(text(
+            "INSERT INTO {} VALUES (:id, :protocol_id, 'x')".format(table)),
+            per_protocol)
+    connection.execute(text(
+        "INSERT INTO decisioncategoryassociations VALUES (:id, :category)"),
+        [{"id": row["id"], "category": row["id"] % 50}
+         for row in per_protocol])
+    todos = [
+        {"id": todo_id, "protocoltype_id": todo_id % 20, "number": todo_id}
+        for todo_id in range(1, protocol_count * 3 + 1)
+    ]
+    connection.execute(text(
+        "INSERT INTO todos VALUES (:id, :protocoltype_id, :number, 'x')"),
+        todos)
+    connection.execute(text(
+        "INSERT INTO todoprotocolassociations "
+        "VALUES (:todo_id, :protocol_id)"),
+        [{"todo_id": todo["id"],
+          "protocol_id": random.randint(1, protocol_count)}
+         for todo in todos])
+    connection.execute(text(
+        "INSERT INTO oldtodos VALUES (:id, :key)"),
+        [{"id": protocol_id, "key": "key-{}".format(protocol_id)}
+         for protocol_id in range(1, protocol_count + 1)])
+
+
+def measure(connection, protocol_count, repetitions):
+    today = date.today()
+    params = {
+        "today": today - timedelta(days=2),
+        "later": today + timedelta(days=14),
+        "protocol_id": protocol_count // 2,
+        "number": protocol_count,
+        "protocol_key": "key-{}".format(protocol_count // 2),
+    }
+    results = {}
+    for name, query in QUERIES:
+        plan = " / ".join(
+            row[-1] for row in connection.execute(
+                text("EXPLAIN QUERY PLAN " + query), params))
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            connection.execute(text(query), params).all()
+        duration = (time.perf_counter() - start) / repetitions
+        results[name] = (plan, duration)
+    return results
+
+
+def apply_migration(connection):
+    spec = importlib.util.spec_from_file_location("migration", MIGRATION)
+    migration = importlib.util.module_from_spec(spec)
+    context = MigrationContext.configure(connection)
+    with Operations.context(context):
+        spec.loader.exec_module(migration)
+        migration.upgrade()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--protocols", type=int, default=10000)
+    parser.add_argument("--repetitions", type=int, default=50)
+    args = parser.parse_args()
+    engine = create_engine("sqlite://")
+    with engine.begin() as connection:
+        seed(connection, args.protocols)
+        connection.execute(text("ANALYZE"))
+        before = measure(connection, args.protocols, args.repetitions)
+        apply_migration(connection)
+        connection.execute(text("ANALYZE"))
+        after = measure(connection, args.protocols, args.repetitions)
+    for name, _ in QUERIES:
+        plan_before, duration_before = before[name]
+        plan_after, duration_after = after[name]
+        print("{}: {:.3f} ms -> {:.3f} ms".format(
+            name, duration_before * 1000, duration_after * 1000))
+        print("    before: {}".format(plan_before))
+        print("    after:  {}".format(plan_after))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import os
+import ipaddress
 from common import auth
 
 import logging
@@ -171,14 +172,22 @@ def check_server_name(SERVER_NAME, PREFERRED_URL_SCHEME, CDN_URL, PERMITTED_META
         ["http", "https"])
 
 
-def check_debug(DEBUG):
+def check_debug(DEBUG, PROFILE_QUERIES, PROFILE_QUERIES_REPEAT_THRESHOLD):
     if DEBUG:
         logger.warning("DEBUG mode is activated!")
+    if PROFILE_QUERIES_REPEAT_THRESHOLD < 2:
+        raise ValueError(
+            "PROFILE_QUERIES_REPEAT_THRESHOLD should be at least 2, is {}!"
+            .format(PROFILE_QUERIES_REPEAT_THRESHOLD))
 
 
 def check_celery(
-        CELERY_BROKER_URL, CELERY_TASK_SERIALIZER, CELERY_ACCEPT_CONTENT):
-    pass
+        CELERY_BROKER_URL, CELERY_TASK_SERIALIZER, CELERY_ACCEPT_CONTENT,
+        CELERY_COALESCE_DELAY):
+    if CELERY_COALESCE_DELAY < 0:
+        raise ValueError(
+            "CELERY_COALESCE_DELAY should be positive, is {}!".format(
+                CELERY_COALESCE_DELAY))
     # todo: check broker url
     check_choice(
         "CELERY_TASK_SERIALIZER", CELERY_TASK_SERIALIZER,
@@ -192,6 +201,25 @@ def check_sentry(SENTRY_DSN):
     pass
 
 
+def check_metrics(
+        METRICS_ALLOWED_NETWORKS, METRICS_PUSH_INTERVAL, METRICS_MAX_AGE):
+    for network in METRICS_ALLOWED_NETWORKS.split(","):
+        try:
+            ipaddress.ip_network(network.strip())
+        except ValueError:
+            raise ValueError(
+                "METRICS_ALLOWED_NETWORKS contains an invalid network: "
+                "{}".format(network))
+    if METRICS_PUSH_INTERVAL < 0:
+        raise ValueError(
+            "METRICS_PUSH_INTERVAL should be positive, is {}!".format(
+                METRICS_PUSH_INTERVAL))
+    if METRICS_MAX_AGE <= 0:
+        raise ValueError(
+            "METRICS_MAX_AGE should be positive, is {}!".format(
+                METRICS_MAX_AGE))
+
+
 def check_authentication(AUTH_MAX_DURATION, AUTH_BACKENDS):
     if AUTH_MAX_DURATION <= 0:
         raise ValueError(
@@ -219,6 +247,16 @@ def check_pagination(PAGE_LENGTH, PAGE_DIFF):
                 PAGE_DIFF))
 
 
+def check_search(SEARCH_BACKEND, SEARCH_MAX_RESULTS):
+    check_choice(
+        "SEARCH_BACKEND", SEARCH_BACKEND,
+        ["auto", "postgres", "sqlite", "python"])
+    if SEARCH_MAX_RESULTS <= 0:
+        raise ValueError(
+            "SEARCH_MAX_RESULTS should be positive, is {}!".format(
+                SEARCH_MAX_RESULTS))
+
+
 def check_index_page(
         MAX_INDEX_DAYS, MAX_PAST_INDEX_DAYS,
         MAX_PAST_INDEX_DAYS_BEFORE_REMINDER):
@@ -298,10 +336,19 @@ def check_rendering(
 
 
 def check_mail(MAIL_FROM, MAIL_HOST, MAIL_USER, MAIL_PASSWORD,
-               MAIL_USE_TLS, MAIL_USE_STARTTLS):
+               MAIL_USE_TLS, MAIL_USE_STARTTLS, MAIL_IDLE_TIMEOUT,
+               MAIL_POOL_SIZE):
     if MAIL_USE_TLS and MAIL_USE_STARTTLS:
         raise ValueError(
             "Both TLS and STARTTLS are set for Mail! Please set only one.")
+    if MAIL_IDLE_TIMEOUT < 0:
+        raise ValueError(
+            "MAIL_IDLE_TIMEOUT should be positive, is {}!".format(
+                MAIL_IDLE_TIMEOUT))
+    if MAIL_POOL_SIZE < 0:
+        raise ValueError(
+            "MAIL_POOL_SIZE should be positive, is {}!".format(
+                MAIL_POOL_SIZE))
     from utils import MailManager
     import socket
     import smtplib
@@ -396,8 +443,13 @@ def check_etherpad(ETHERPAD_URL, ETHERPAD_API_URL, ETHERPAD_APIKEY, EMPTY_ETHERP
 
 def check_wiki(
         WIKI_TYPE, WIKI_API_URL, WIKI_ANONYMOUS,
-        WIKI_USER, WIKI_PASSWORD, WIKI_DOMAIN):
-    check_choice("WIKI_TYPE", WIKI_TYPE, ["MEDIAWIKI", "DOKUWIKI"])
+        WIKI_USER, WIKI_PASSWORD, WIKI_DOMAIN, WIKI_INDEX_DELAY):
+    check_choice(
+        "WIKI_TYPE", WIKI_TYPE, ["MEDIAWIKI", "DOKUWIKI", "GITLAB_WIKI"])
+    if WIKI_INDEX_DELAY < 0:
+        raise ValueError(
+            "WIKI_INDEX_DELAY should be positive, is {}!".format(
+                WIKI_INDEX_DELAY))
     # todo: check the connection
 
 
@@ -416,6 +468,33 @@ def check_timezone(CALENDAR_TIMEZONE_MAP):
     pass
 
 
+def check_fragment_cache(
+        FRAGMENT_CACHE_BACKEND, FRAGMENT_CACHE_URL, FRAGMENT_CACHE_TIMEOUT):
+    check_choice(
+        "FRAGMENT_CACHE_BACKEND", FRAGMENT_CACHE_BACKEND,
+        ["memory", "redis", "none"])
+    if FRAGMENT_CACHE_TIMEOUT <= 0:
+        raise ValueError(
+            "FRAGMENT_CACHE_TIMEOUT should be positive, is {}!".format(
+                FRAGMENT_CACHE_TIMEOUT))
+
+
+def check_feeds(
+        FEED_MAX_ENTRIES, FEED_CACHE_TIMEOUT, FEED_CALENDAR_PAST_DAYS):
+    if FEED_MAX_ENTRIES <= 0:
+        raise ValueError(
+            "FEED_MAX_ENTRIES should be positive, is {}!".format(
+                FEED_MAX_ENTRIES))
+    if FEED_CACHE_TIMEOUT < 0:
+        raise ValueError(
+            "FEED_CACHE_TIMEOUT should not be negative, is {}!".format(
+                FEED_CACHE_TIMEOUT))
+    if FEED_CALENDAR_PAST_DAYS < 0:
+        raise ValueError(
+            "FEED_CALENDAR_PAST_DAYS should not be negative, is {}!".format(
+                FEED_CALENDAR_PAST_DAYS))
+
+
 CONFIG_SECTIONS = [
     ConfigSection(
         name="Database",
@@ -508,6 +587,20 @@ CONFIG_SECTIONS = [
                 default=False,
                 required=False, internal=True,
                 description="Activate debug mode"),
+            ConfigEntry(
+                name="PROFILE_QUERIES",
+                default=False,
+                required=False, internal=True,
+                description=(
+                    "Count and time the SQL queries of every request, add "
+                    "X-Query-* response headers and log repeated queries.")),
+            ConfigEntry(
+                name="PROFILE_QUERIES_REPEAT_THRESHOLD",
+                default=5,
+                required=False, internal=True,
+                description=(
+                    "How often the same statement has to run in one request "
+                    "to be logged as a possible N+1 query.")),
         ],
         check=check_debug,
         description="Debug mode. Do not set in production."),
@@ -531,6 +624,14 @@ CONFIG_SECTIONS = [
                 default=['pickle'],
                 required=False, internal=True, immutable=True,
                 description="How celery deserializes tasks. Do not change."),
+            ConfigEntry(
+                name="CELERY_COALESCE_DELAY",
+                default=3,
+                required=False, internal=False,
+                description=(
+                    "Seconds to wait before parsing, compiling or pushing a "
+                    "protocol. Newer requests for the same protocol replace "
+                    "pending ones.")),
         ],
         check=check_celery,
         description="Settings for the task scheduler."),
@@ -547,6 +648,33 @@ CONFIG_SECTIONS = [
         ],
         check=check_sentry,
         description="Connection information for sentry exception reporting."),
+    ConfigSection(
+        name="METRICS",
+        entries=[
+            ConfigEntry(
+                name="METRICS_ALLOWED_NETWORKS",
+                default="127.0.0.1/32, ::1/128",
+                required=False, internal=True,
+                description=(
+                    "Comma separated networks which may read /metrics.")),
+            ConfigEntry(
+                name="METRICS_PUSH_INTERVAL",
+                default=15,
+                required=False, internal=True,
+                description=(
+                    "Seconds between two pushes of the metrics of a celery "
+                    "worker process.")),
+            ConfigEntry(
+                name="METRICS_MAX_AGE",
+                default=86400,
+                required=False, internal=True,
+                description=(
+                    "Seconds after which the metrics of a worker process "
+                    "that stopped pushing are dropped.")),
+        ],
+        check=check_metrics,
+        deactivatable=True,
+        description="Prometheus metrics of the server and the workers."),
     ConfigSection(
         name="Authentication",
         entries=[
@@ -598,6 +726,25 @@ CONFIG_SECTIONS = [
         ],
         check=check_pagination,
         description="Pagination settings, used for list pages"),
+    ConfigSection(
+        name="Search",
+        entries=[
+            ConfigEntry(
+                name="SEARCH_BACKEND",
+                default="auto",
+                required=False, internal=True,
+                description=(
+                    "Full-text search implementation: postgres, sqlite "
+                    "(FTS5), python (in memory) or auto to choose by the "
+                    "database")),
+            ConfigEntry(
+                name="SEARCH_MAX_RESULTS",
+                default=1000,
+                required=False, internal=True,
+                description="Maximum number of ranked search results"),
+        ],
+        check=check_search,
+        description="Settings for searching protocols, decisions and todos"),
     ConfigSection(
         name="Index Page",
         entries=[
@@ -820,7 +967,20 @@ CONFIG_SECTIONS = [
                 default=False,
                 required=False, internal=True,
                 description="Use SMTP with STARTTLS. Should match port."),
-
+            ConfigEntry(
+                name="MAIL_IDLE_TIMEOUT",
+                default=60,
+                required=False, internal=True,
+                description=(
+                    "Seconds an idle SMTP connection is kept open "
+                    "for reuse")),
+            ConfigEntry(
+                name="MAIL_POOL_SIZE",
+                default=1,
+                required=False, internal=True,
+                description=(
+                    "Number of idle SMTP connections kept open per worker. "
+                    "0 disables connection reuse.")),
         ],
         check=check_mail,
         deactivatable=True,
@@ -926,6 +1086,13 @@ CONFIG_SECTIONS = [
                 default=None,
                 required=False, internal=True,
                 description="Login domain (only for Mediawiki)"),
+            ConfigEntry(
+                name="WIKI_INDEX_DELAY",
+                default=30,
+                required=False, internal=True,
+                description=(
+                    "Seconds to wait for further pushes before saving the "
+                    "category index (only for GitLab Wiki)")),
         ],
         check=check_wiki,
         deactivatable=True,
@@ -968,6 +1135,56 @@ CONFIG_SECTIONS = [
         ],
         check=check_timezone,
         description="Settings for translating timezone information."),
+    ConfigSection(
+        name="Feeds",
+        entries=[
+            ConfigEntry(
+                name="FEED_MAX_ENTRIES",
+                default=100,
+                required=False, internal=False,
+                description=(
+                    "Maximum number of protocols in a RSS, Atom or iCal "
+                    "feed, the most recent ones are kept")),
+            ConfigEntry(
+                name="FEED_CACHE_TIMEOUT",
+                default=300,
+                required=False, internal=True,
+                description=(
+                    "Seconds a rendered feed is kept. Changes made by "
+                    "other processes show up after this time at most.")),
+            ConfigEntry(
+                name="FEED_CALENDAR_PAST_DAYS",
+                default=365,
+                required=False, internal=False,
+                description=(
+                    "Past days to include meetings from in the iCal "
+                    "feeds")),
+        ],
+        check=check_feeds,
+        description="Settings for the protocol and appointment feeds"),
+    ConfigSection(
+        name="Fragment Cache",
+        entries=[
+            ConfigEntry(
+                name="FRAGMENT_CACHE_BACKEND",
+                default="memory",
+                required=False, internal=True,
+                description=(
+                    "Where rendered parts of the protocol pages are kept: "
+                    "memory (per process), redis (shared) or none")),
+            ConfigEntry(
+                name="FRAGMENT_CACHE_URL",
+                default="redis://localhost:6379/1",
+                required=False, internal=True,
+                description="Redis server for the redis backend"),
+            ConfigEntry(
+                name="FRAGMENT_CACHE_TIMEOUT",
+                default=3600,
+                required=False, internal=True,
+                description="Seconds a rendered fragment is kept"),
+        ],
+        check=check_fragment_cache,
+        description="Cache for the rendered parts of protocol pages"),
 ]
 
 
@@ -3,6 +3,7 @@ from functools import wraps
 from flask import flash
 
 from models.database import ALL_MODELS
+from models import profiles
 from shared import current_user
 from common import back
 
@@ -62,3 +63,18 @@ def require_publish_right(require_exist=True):
 
 def require_admin_right(require_exist=True):
     return require_right("admin", require_exist)
+
+
+def load_profile(profile):
+    """Reloads the object found by db_lookup with an eager loading profile."""
+    model_name = profiles.get_model(profile).__model_name__
+
+    def _decorator(function):
+        @wraps(function)
+        def _decorated_function(*args, **kwargs):
+            if kwargs.get(model_name) is not None:
+                kwargs[model_name] = profiles.load(
+                    kwargs[model_name], profile)
+            return function(*args, **kwargs)
+        return _decorated_function
+    return _decorator
@@ -0,0 +1,212 @@
+"""Loading and caching for the RSS, Atom and iCal feeds.
+
+Feed readers and calendar clients poll the feeds every few minutes. The
+rendered feeds are kept per feed kind and set of protocol types, which
+is also their visibility, and dropped once a protocol of one of these
+types changes. Clients get an ETag and Last-Modified date and are answered
+with 304 Not Modified as long as the feed stays the same.
+
+The host of the request is part of the key, as the links in the feeds
+depend on it. Clients choose it, so at most FEED_CACHE_SIZE feeds are kept
+and the least recently used one is dropped first.
+
+Changes committed by other processes, e.g. the celery workers parsing
+protocols, do not reach this cache, so feeds also expire after
+FEED_CACHE_TIMEOUT seconds.
+"""
+import threading
+import time
+from collections import namedtuple, defaultdict, OrderedDict
+from datetime import datetime, timezone, date, timedelta
+from hashlib import sha256
+
+from dateutil import tz
+from flask import Response, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from shared import config, db
+from models.database import (
+    ProtocolType, Protocol, TOP, LocalTOP, DefaultTOP, Meta, Document)
+from metrics import count_cache
+
+CachedFeed = namedtuple(
+    "CachedFeed", ["content", "etag", "last_modified", "expires"])
+CalendarEvent = namedtuple(
+    "CalendarEvent", ["protocol_id", "summary", "start", "top_names"])
+
+FEED_MODELS = (ProtocolType, Protocol, TOP, LocalTOP, DefaultTOP, Meta,
+               Document)
+
+FEED_CACHE_SIZE = 1000
+
+
+class FeedCache:
+    def __init__(self, size=FEED_CACHE_SIZE):
+        self.size = size
+        self._feeds = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        # expired feeds are kept until they are rebuilt, so that put can
+        # keep their date
+        with self._lock:
+            feed = self._feeds.get(key)
+            if feed is not None:
+                self._feeds.move_to_end(key)
+        if feed is not None and feed.expires < time.monotonic():
+            feed = None
+        count_cache("feeds", feed is not None)
+        return feed
+
+    def put(self, key, content):
+        etag = sha256(content).hexdigest()
+        with self._lock:
+            # a rebuilt feed that did not change keeps its date
+            last_feed = self._feeds.get(key)
+            if last_feed is not None and last_feed.etag == etag:
+                last_modified = last_feed.last_modified
+            else:
+                last_modified = datetime.now(timezone.utc).replace(
+                    microsecond=0)
+            feed = CachedFeed(
+                content=content, etag=etag, last_modified=last_modified,
+                expires=time.monotonic() + getattr(
+                    config, "FEED_CACHE_TIMEOUT", 300))
+            self._feeds[key] = feed
+            self._feeds.move_to_end(key)
+            while len(self._feeds) > self.size:
+                self._feeds.popitem(last=False)
+        return feed
+
+    def invalidate(self, protocoltype_ids):
+        protocoltype_ids = set(protocoltype_ids)
+        with self._lock:
+            for key in list(self._feeds):
+                if protocoltype_ids.intersection(key[-1]):
+                    del self._feeds[key]
+
+    def clear(self):
+        with self._lock:
+            self._feeds.clear()
+
+
+feed_cache = FeedCache()
+
+
+def get_max_entries():
+    return getattr(config, "FEED_MAX_ENTRIES", 100)
+
+
+def get_calendar_start():
+    return date.today() - timedelta(
+        days=getattr(config, "FEED_CALENDAR_PAST_DAYS", 365))
+
+
+def load_calendar_events(protocoltype_ids, done=None, since=None):
+    """Loads the calendar events of the newest protocols of the types.
+
+    Protocols, their TOPs and the default TOPs of their types are read
+    with one query each. Like Protocol.get_tops, the default TOPs surround
+    the TOPs of protocols that only have planned TOPs.
+    """
+    query = (
+        db.session.query(
+            Protocol.id, Protocol.protocoltype_id, Protocol.date,
+            Protocol.start_time, ProtocolType.short_name,
+            ProtocolType.usual_time)
+        .join(ProtocolType, Protocol.protocoltype_id == ProtocolType.id)
+        .filter(Protocol.protocoltype_id.in_(protocoltype_ids)))
+    if done is not None:
+        query = query.filter(Protocol.done == done)
+    if since is not None:
+        query = query.filter(Protocol.date >= since)
+    protocols = (
+        query.order_by(Protocol.date.desc(), Protocol.id.desc())
+        .limit(get_max_entries()).all())
+    if not protocols:
+        return []
+    tops = defaultdict(list)
+    for top in (
+            db.session.query(TOP.protocol_id, TOP.name, TOP.planned)
+            .filter(TOP.protocol_id.in_(
+                [protocol.id for protocol in protocols]))
+            .order_by(TOP.protocol_id, TOP.number)):
+        tops[top.protocol_id].append(top)
+    default_tops = defaultdict(list)
+    for default_top in (
+            db.session.query(
+                DefaultTOP.protocoltype_id, DefaultTOP.name,
+                DefaultTOP.number)
+            .filter(DefaultTOP.protocoltype_id.in_(
+                set(protocol.protocoltype_id for protocol in protocols)))
+            .order_by(DefaultTOP.number)):
+        default_tops[default_top.protocoltype_id].append(default_top)
+    events = []
+    for protocol in protocols:
+        protocol_tops = tops[protocol.id]
+        top_names = [top.name for top in protocol_tops]
+        if all(top.planned for top in protocol_tops):
+            type_tops = default_tops[protocol.protocoltype_id]
+            top_names = (
+                [top.name for top in type_tops if top.number <= 0]
+                + top_names
+                + [top.name for top in type_tops if top.number > 0])
+        start = datetime.combine(
+            protocol.date, protocol.start_time or protocol.usual_time)
+        events.append(CalendarEvent(
+            protocol_id=protocol.id, summary=protocol.short_name,
+            start=start.replace(tzinfo=tz.tzlocal()),
+            top_names=[name for name in top_names if name is not None]))
+    return events
+
+
+def get_timezone_id(value):
+    name = value.tzname()
+    return getattr(config, "CALENDAR_TIMEZONE_MAP", {}).get(name, name)
+
+
+def make_response(kind, protocoltypes, mimetype, render):
+    """Answers a feed request from the cache, rendering it if needed.
+
+    render is only called on a cache miss and returns the feed as bytes.
+    """
+    key = (request.host_url, kind,
+           tuple(sorted(protocoltype.id for protocoltype in protocoltypes)))
+    feed = feed_cache.get(key)
+    if feed is None:
+        feed = feed_cache.put(key, render())
+    response = Response(feed.content, mimetype=mimetype)
+    response.set_etag(feed.etag)
+    response.last_modified = feed.last_modified
+    return response.make_conditional(request)
+
+
+def _get_protocoltype_id(instance):
+    while instance is not None and not isinstance(instance, ProtocolType):
+        instance = instance.get_parent()
+    if instance is not None:
+        return instance.id
+
+
+@event.listens_for(Session, "after_flush")
+def collect_changed_feeds(session, flush_context):
+    changed = session.info.setdefault("changed_protocoltype_ids", set())
+    for instance in (
+            list(session.new) + list(session.dirty) + list(session.deleted)):
+        if isinstance(instance, FEED_MODELS):
+            protocoltype_id = _get_protocoltype_id(instance)
+            if protocoltype_id is not None:
+                changed.add(protocoltype_id)
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_changed_feeds(session):
+    changed = session.info.pop("changed_protocoltype_ids", None)
+    if changed:
+        feed_cache.invalidate(changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_changed_feeds(session):
+    session.info.pop("changed_protocoltype_ids", None)
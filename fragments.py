@@ -0,0 +1,112 @@
+"""Cache for the rendered fragments of the protocol page.
+
+The protocol content, the documents table and the TOP list are cached
+per protocol, protocol version and visibility of the viewer. The version
+is counted up by every flush changing the protocol, its TOPs, local TOPs
+or documents, or the default TOPs of its type, so old fragments are never
+served again.
+
+The fragments are kept in this process ("memory") or in redis ("redis"),
+which is shared by all web processes.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from markupsafe import Markup
+
+from shared import config
+from metrics import count_cache
+
+MEMORY_CACHE_SIZE = 1000
+KEY_PREFIX = "proto3:fragment:"
+
+
+class MemoryFragmentBackend:
+    def __init__(self, size=MEMORY_CACHE_SIZE):
+        self.size = size
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            fragment, expires = self._fragments.get(key, (None, None))
+            if fragment is not None:
+                if expires < time.monotonic():
+                    del self._fragments[key]
+                    return None
+                self._fragments.move_to_end(key)
+            return fragment
+
+    def set(self, key, fragment, timeout):
+        with self._lock:
+            self._fragments[key] = (fragment, time.monotonic() + timeout)
+            self._fragments.move_to_end(key)
+            while len(self._fragments) > self.size:
+                self._fragments.popitem(last=False)
+
+
+class RedisFragmentBackend:
+    def __init__(self, url):
+        import redis
+        self.error = redis.RedisError
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        try:
+            fragment = self.client.get(KEY_PREFIX + key)
+        except self.error:
+            return None
+        if fragment is not None:
+            return fragment.decode("utf-8")
+
+    def set(self, key, fragment, timeout):
+        try:
+            self.client.set(
+                KEY_PREFIX + key, fragment.encode("utf-8"), ex=timeout)
+        except self.error:
+            pass
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if getattr(config, "FRAGMENT_CACHE_BACKEND", "memory") == "redis":
+                _backend = RedisFragmentBackend(getattr(
+                    config, "FRAGMENT_CACHE_URL",
+                    "redis://localhost:6379/1"))
+            else:
+                _backend = MemoryFragmentBackend()
+        return _backend
+
+
+def is_cacheable(protocol, user):
+    # editors and admins see links with their CSRF token and on april 1st
+    # the likes address the viewer, neither can be shared with others
+    today = datetime.now()
+    return (
+        getattr(config, "FRAGMENT_CACHE_BACKEND", "memory") != "none"
+        and not protocol.has_modify_right(user)
+        and not protocol.has_admin_right(user)
+        and not (today.month == 4 and today.day == 1))
+
+
+def get_fragment(name, protocol, private, render):
+    """Returns the cached fragment, render is called on a miss."""
+    key = "{}:{}:{}:{}".format(
+        name, protocol.id, protocol.version,
+        "private" if private else "public")
+    backend = get_backend()
+    fragment = backend.get(key)
+    count_cache("fragments", fragment is not None)
+    if fragment is None:
+        fragment = str(render())
+        backend.set(
+            key, fragment, getattr(config, "FRAGMENT_CACHE_TIMEOUT", 3600))
+    return Markup(fragment)
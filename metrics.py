@@ -0,0 +1,209 @@
+"""Counters and histograms in the Prometheus text format.
+
+Every process keeps its own registry. The web server exposes it at
+/metrics, the celery workers push snapshots of theirs to the database
+from where the web server adds them to its output.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace("\"", "\\\""))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{{{}}}".format(",".join(
+        "{}=\"{}\"".format(name, _escape(value)) for name, value in labels))
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(
+            (name, str(labels[name])) for name in self.labelnames)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [
+                (self.name, list(key), value)
+                for key, value in self._values.items()
+            ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            bucket_counts, _, _ = entry = self._values[key]
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                bucket_counts[index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the duration of the block.
+
+        A result label is set to "ok" or "error" depending on whether the
+        block raised.
+        """
+        start = time.perf_counter()
+        result = "error"
+        try:
+            yield
+            result = "ok"
+        finally:
+            if "result" in self.labelnames:
+                labels["result"] = result
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for key, (bucket_counts, total, count) in self._values.items():
+                cumulative = 0
+                for bucket, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    result.append((
+                        self.name + "_bucket",
+                        list(key) + [("le", _format_value(bucket))],
+                        cumulative))
+                result.append((
+                    self.name + "_bucket", list(key) + [("le", "+Inf")],
+                    count))
+                result.append((self.name + "_sum", list(key), total))
+                result.append((self.name + "_count", list(key), count))
+        return result
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, description, labelnames=()):
+        metric = Counter(name, description, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, description, labelnames=(),
+                  buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, description, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self):
+        return [
+            [metric.name, metric.kind, metric.description, metric.samples()]
+            for metric in self.metrics
+        ]
+
+    def dump(self):
+        return json.dumps(self.collect())
+
+
+def get_process_name():
+    return "{}-{}".format(socket.gethostname(), os.getpid())
+
+
+def render(sources):
+    """Renders the collected metrics of several processes.
+
+    sources is a list of (process name, collected metrics) pairs.
+    """
+    descriptions = {}
+    samples = {}
+    for process, collected in sources:
+        for name, kind, description, metric_samples in collected:
+            descriptions.setdefault(name, (kind, description))
+            for sample_name, labels, value in metric_samples:
+                labels = [("process", process)] + [
+                    tuple(label) for label in labels]
+                samples.setdefault(name, []).append(
+                    (sample_name, labels, value))
+    lines = []
+    for name, (kind, description) in descriptions.items():
+        lines.append("# HELP {} {}".format(name, description))
+        lines.append("# TYPE {} {}".format(name, kind))
+        for sample_name, labels, value in samples.get(name, []):
+            lines.append("{}{} {}".format(
+                sample_name, _format_labels(labels), _format_value(value)))
+    return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_DURATION = registry.histogram(
+    "proto3_request_duration_seconds", "Duration of HTTP requests.",
+    ["route", "method", "status"])
+REQUEST_QUERIES = registry.histogram(
+    "proto3_request_queries", "SQL queries per HTTP request.",
+    ["route"], buckets=QUERY_BUCKETS)
+TASK_DURATION = registry.histogram(
+    "proto3_task_duration_seconds", "Runtime of celery tasks.",
+    ["task", "state"])
+TASK_QUEUE_WAIT = registry.histogram(
+    "proto3_task_queue_wait_seconds",
+    "Time between publishing and starting a celery task.", ["task"])
+XELATEX_DURATION = registry.histogram(
+    "proto3_xelatex_duration_seconds", "Duration of LaTeX compilations.",
+    ["result"])
+MAIL_DURATION = registry.histogram(
+    "proto3_mail_duration_seconds", "Duration of sending mails.",
+    ["result"])
+WIKI_PUSH_DURATION = registry.histogram(
+    "proto3_wiki_push_duration_seconds", "Duration of wiki pushes.",
+    ["wiki", "result"])
+CACHE_REQUESTS = registry.counter(
+    "proto3_cache_requests_total", "Lookups in caches by result.",
+    ["cache", "result"])
+
+
+def count_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
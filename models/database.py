@@ -1,9 +1,12 @@
-from flask import render_template
+from flask import render_template, g, has_request_context
 
 from datetime import datetime
 from io import BytesIO
 from enum import Enum
+from collections import namedtuple
 from uuid import uuid4
+from hashlib import sha256
+import json
 from urllib.parse import urlparse
 
 from shared import (
@@ -15,12 +18,19 @@ from dateutil import tz
 
 import os
 
-from sqlalchemy import event
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy import event, and_, or_, update, select, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import relationship, backref, Session
 
 from todostates import make_states, make_state_glyphes
 
 
+GitlabIndexEntry = namedtuple("GitlabIndexEntry", ["date", "pagetitle", "linked"])
+ProtocolTypeRights = namedtuple("ProtocolTypeRights", [
+    "public_view", "public_view_anywhere", "private_view", "modify",
+    "publish", "admin"])
+
+
 class DatabaseModel(db.Model):
     __abstract__ = True
 
@@ -99,6 +109,9 @@ class ProtocolType(DatabaseModel):
     decisioncategories = relationship(
         "DecisionCategory", backref=backref("protocoltype"),
         cascade="all, delete-orphan")
+    wikipushes = relationship(
+        "WikiPush", backref=backref("protocoltype"),
+        cascade="all, delete-orphan")
 
     def get_latest_protocol(self):
         candidates = sorted([
@@ -114,12 +127,42 @@ class ProtocolType(DatabaseModel):
             if protocol.date == protocol_date
         ]
 
+    def get_rights(self, user):
+        """Returns the rights of the user, computed once per request."""
+        if not has_request_context() or self.id is None:
+            return self.compute_rights(user)
+        matrix = g.setdefault("permission_matrix", {})
+        key = (getattr(user, "username", None), self.id)
+        if key not in matrix:
+            matrix[key] = self.compute_rights(user)
+        return matrix[key]
+
+    def compute_rights(self, user):
+        def _in_group(group):
+            return user is not None and group != "" and group in user.groups
+        admin = user is not None and config.ADMIN_GROUP in user.groups
+        authenticated = (
+            _in_group(self.public_group) or _in_group(self.private_group))
+        public_view_anywhere = bool(
+            self.has_public_anonymous_view_right(check_networks=False)
+            or authenticated or admin)
+        public_view = public_view_anywhere
+        if (public_view and not authenticated and not admin
+                and self.restrict_networks):
+            public_view = bool(self.has_public_anonymous_view_right())
+        return ProtocolTypeRights(
+            public_view=public_view,
+            public_view_anywhere=public_view_anywhere,
+            private_view=_in_group(self.private_group) or admin,
+            modify=_in_group(self.modify_group) or admin,
+            publish=_in_group(self.publish_group) or admin,
+            admin=admin)
+
     def has_public_view_right(self, user, check_networks=True):
-        return (
-            self.has_public_anonymous_view_right(check_networks=check_networks)
-            or (user is not None
-                and self.has_public_authenticated_view_right(user))
-            or self.has_admin_right(user))
+        rights = self.get_rights(user)
+        if check_networks:
+            return rights.public_view
+        return rights.public_view_anywhere
 
     def has_public_anonymous_view_right(self, check_networks=True):
         return (
@@ -134,28 +177,16 @@ class ProtocolType(DatabaseModel):
                 and self.private_group in user.groups))
 
     def has_private_view_right(self, user):
-        return (
-            (user is not None
-             and (self.private_group != ""
-                  and self.private_group in user.groups))
-            or self.has_admin_right(user))
+        return self.get_rights(user).private_view
 
     def has_modify_right(self, user):
-        return (
-            (user is not None
-             and (self.modify_group != ""
-                  and self.modify_group in user.groups))
-            or self.has_admin_right(user))
+        return self.get_rights(user).modify
 
     def has_publish_right(self, user):
-        return (
-            (user is not None
-             and (self.publish_group != ""
-                  and self.publish_group in user.groups))
-            or self.has_admin_right(user))
+        return self.get_rights(user).publish
 
     def has_admin_right(self, user):
-        return (user is not None and config.ADMIN_GROUP in user.groups)
+        return self.get_rights(user).admin
 
     @staticmethod
     def get_modifiable_protocoltypes(user):
@@ -179,9 +210,76 @@ class ProtocolType(DatabaseModel):
             if protocoltype.has_private_view_right(user)
         ]
 
+    @staticmethod
+    def get_ids_with_right(user, right):
+        """Lists the ids of the types on which the user has the right.
+
+        right is one of the fields of ProtocolTypeRights. The ids for all
+        rights are collected in one pass and kept for the request.
+        """
+        if not has_request_context():
+            return ProtocolType.get_ids_with_rights(user)[right]
+        ids = g.setdefault("protocoltype_right_ids", {})
+        key = getattr(user, "username", None)
+        if key not in ids:
+            ids[key] = ProtocolType.get_ids_with_rights(user)
+        return ids[key][right]
+
+    @staticmethod
+    def get_ids_with_rights(user):
+        ids = {right: [] for right in ProtocolTypeRights._fields}
+        for protocoltype in ProtocolType.query.all():
+            rights = protocoltype.get_rights(user)
+            for right, value in rights._asdict().items():
+                if value:
+                    ids[right].append(protocoltype.id)
+        return ids
+
+    def get_parse_hash(self):
+        """Hashes the settings of the type that the parsed protocols use."""
+        settings = [
+            self.name, self.short_name, self.organization, self.usual_time,
+            self.latex_template, self.use_wiki, self.wiki_category,
+            self.wiki_only_public, self.non_reproducible_pad_links,
+            [(top.name, top.number, top.description)
+             for top in self.default_tops],
+            [(meta.key, meta.name, meta.value, meta.internal, meta.prior)
+             for meta in sorted(self.metas, key=lambda meta: meta.id)],
+            sorted(
+                category.name or ""
+                for category in self.decisioncategories),
+        ]
+        return sha256(
+            json.dumps(settings, default=str).encode("utf-8")).hexdigest()
+
     def get_wiki_infobox(self):
         return "Infobox {}".format(self.short_name)
 
+    def get_gitlab_wiki_category(self):
+        return self.wiki_category or "protokoll"
+
+    def get_gitlab_wiki_pagetitle(self, protocol_date):
+        return "{}/{}/{}-{:%Y-%m-%d}".format(
+            self.get_gitlab_wiki_category(), protocol_date.year,
+            self.short_name, protocol_date)
+
+    def get_gitlab_wiki_index_entries(self):
+        """Lists the protocols of the category index without loading them."""
+        has_source = and_(Protocol.source.isnot(None), Protocol.source != "")
+        rows = (
+            db.session.query(Protocol.date, has_source)
+            .filter(Protocol.protocoltype_id == self.id,
+                    Protocol.date.isnot(None))
+            .order_by(Protocol.date.desc())
+            .all())
+        return [
+            GitlabIndexEntry(
+                date=protocol_date,
+                pagetitle=self.get_gitlab_wiki_pagetitle(protocol_date),
+                linked=bool(linked))
+            for protocol_date, linked in rows
+        ]
+
     def get_wiki_infobox_title(self):
         return "Vorlage:{}".format(self.get_wiki_infobox())
 
@@ -196,12 +294,23 @@ class Protocol(DatabaseModel):
     content_private = db.Column(db.Text)
     content_html_public = db.Column(db.Text)
     content_html_private = db.Column(db.Text)
-    date = db.Column(db.Date)
+    date = db.Column(db.Date, index=True)
     start_time = db.Column(db.Time)
     end_time = db.Column(db.Time)
     done = db.Column(db.Boolean, nullable=False, default=False)
     public = db.Column(db.Boolean)
     pad_identifier = db.Column(db.Text)
+    parsed_source_hash = db.Column(db.String(64))
+    parsed_type_hash = db.Column(db.String(64))
+    parsed_parser_version = db.Column(db.String(64))
+    parsed_template_version = db.Column(db.String(64))
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index("ix_protocols_protocoltype_id_date",
+                 "protocoltype_id", "date"),
+        db.Index("ix_protocols_done_date", "done", "date"),
+    )
 
     tops = relationship(
         "TOP", backref=backref("protocol"),
@@ -219,12 +328,33 @@ class Protocol(DatabaseModel):
         "Meta", backref=backref("protocol"), cascade="all, delete-orphan")
     localtops = relationship(
         "LocalTOP", backref=backref("protocol"), cascade="all, delete-orphan")
+    parsetimings = relationship(
+        "ParseTiming", backref=backref("protocol"),
+        cascade="all, delete-orphan", order_by="ParseTiming.position")
 
     likes = relationship("Like", secondary="likeprotocolassociations")
 
     def get_parent(self):
         return self.protocoltype
 
+    def get_source_hash(self):
+        return sha256((self.source or "").encode("utf-8")).hexdigest()
+
+    def is_parsed_unchanged(self, parser_version, template_version):
+        return (
+            self.done
+            and len(self.errors) == 0
+            and self.parsed_source_hash == self.get_source_hash()
+            and self.parsed_type_hash == self.protocoltype.get_parse_hash()
+            and self.parsed_parser_version == parser_version
+            and self.parsed_template_version == template_version)
+
+    def mark_parsed(self, parser_version, template_version):
+        self.parsed_source_hash = self.get_source_hash()
+        self.parsed_type_hash = self.protocoltype.get_parse_hash()
+        self.parsed_parser_version = parser_version
+        self.parsed_template_version = template_version
+
     def create_error(self, action, name, description):
         now = datetime.now()
         return Error(
@@ -350,9 +480,7 @@ class Protocol(DatabaseModel):
 
             The default namespace 'protokoll', is used if protocoltype.wiki_category is empty.
         """
-        category = self.protocoltype.wiki_category or "protokoll"
-        return "{}/{}/{}-{:%Y-%m-%d}".format(
-            category, self.date.year, self.protocoltype.short_name, self.date)
+        return self.protocoltype.get_gitlab_wiki_pagetitle(self.date)
 
     def get_etherpad_link(self):
         if self.pad_identifier is None:
@@ -382,7 +510,7 @@ class Protocol(DatabaseModel):
     def get_originating_todos(self):
         return [
             todo for todo in self.todos
-            if self == todo.get_first_protocol()
+            if todo.first_protocol_id == self.id
         ]
 
     def get_open_todos(self):
@@ -476,9 +604,31 @@ class Protocol(DatabaseModel):
         return protocol
 
 
-@event.listens_for(Protocol, "before_delete")
-def on_protocol_delete(mapper, connection, protocol):
-    protocol.delete_orphan_todos()
+@event.listens_for(Session, "before_flush")
+def on_protocol_delete(session, flush_context, instances):
+    """Deletes the todos that only belong to deleted protocols.
+
+    This has to look at todoprotocolassociations before the flush removes
+    the rows of the deleted protocols.
+    """
+    protocol_ids = {
+        instance.id for instance in session.deleted
+        if isinstance(instance, Protocol)
+    }
+    if not protocol_ids:
+        return
+    shared_todo_ids = (
+        select(TodoProtocolAssociation.todo_id)
+        .where(TodoProtocolAssociation.protocol_id.not_in(protocol_ids)))
+    orphan_todo_ids = (
+        select(TodoProtocolAssociation.todo_id)
+        .where(TodoProtocolAssociation.protocol_id.in_(protocol_ids),
+               TodoProtocolAssociation.todo_id.not_in(shared_todo_ids)))
+    with session.no_autoflush:
+        orphan_todos = session.scalars(
+            select(Todo).where(Todo.id.in_(orphan_todo_ids))).all()
+    for todo in orphan_todos:
+        session.delete(todo)
 
 
 class DefaultTOP(DatabaseModel):
@@ -557,7 +707,8 @@ class Document(DatabaseModel):
     __tablename__ = "documents"
     __model_name__ = "document"
     id = db.Column(db.Integer, primary_key=True)
-    protocol_id = db.Column(db.Integer, db.ForeignKey("protocols.id"))
+    protocol_id = db.Column(
+        db.Integer, db.ForeignKey("protocols.id"), index=True)
     name = db.Column(db.Text)
     filename = db.Column(db.Text)
     is_compiled = db.Column(db.Boolean)
@@ -698,16 +849,26 @@ class Todo(DatabaseModel):
     __tablename__ = "todos"
     __model_name__ = "todo"
     id = db.Column(db.Integer, primary_key=True)
-    protocoltype_id = db.Column(db.Integer, db.ForeignKey("protocoltypes.id"))
-    number = db.Column(db.Integer)
+    protocoltype_id = db.Column(
+        db.Integer, db.ForeignKey("protocoltypes.id"), index=True)
+    number = db.Column(db.Integer, index=True)
     who = db.Column(db.Text)
     description = db.Column(db.Text)
     state = db.Column(db.Enum(TodoState), nullable=False)
     date = db.Column(db.Date, nullable=True)
+    first_protocol_id = db.Column(db.Integer, index=True)
+    first_protocol_date = db.Column(db.Date)
 
     protocols = relationship(
         "Protocol", secondary="todoprotocolassociations", backref="todos")
+    first_protocol = relationship(
+        "Protocol",
+        primaryjoin="foreign(Todo.first_protocol_id) == Protocol.id",
+        viewonly=True)
     likes = relationship("Like", secondary="liketodoassociations")
+    assignees = relationship(
+        "TodoAssignee", backref=backref("todo"),
+        cascade="all, delete-orphan")
 
     def get_parent(self):
         return self.protocoltype
@@ -720,21 +881,51 @@ class Todo(DatabaseModel):
                 return datetime.now().date() >= self.date
         return self.state.is_done()
 
+    @staticmethod
+    def is_open_clause(today=None):
+        """SQL counterpart of not is_done()"""
+        if today is None:
+            today = datetime.now().date()
+        done_states = [state for state in TodoState if state.is_done()]
+        return and_(
+            Todo.state.notin_(done_states),
+            or_(Todo.state != TodoState.after, Todo.date < today),
+            or_(Todo.state != TodoState.before, Todo.date > today))
+
     def get_id(self):
         return self.number if self.number is not None else self.id
 
     def get_first_protocol(self):
-        candidates = sorted(self.protocols, key=lambda p: p.date)
-        if len(candidates) == 0:
-            return None
-        return candidates[0]
+        return self.first_protocol
 
     def get_users(self):
+        return Todo.split_users(self.who)
+
+    @staticmethod
+    def split_users(who):
+        if who is None:
+            return []
         return [
-            user.lower().strip()
-            for user in split_terms(self.who, separators=" ,\t")
+            normalize_assignee(user)
+            for user in split_terms(who, separators=" ,\t")
         ]
 
+    def update_assignees(self, who):
+        names = set(filter(None, Todo.split_users(who)))
+        with db.session.no_autoflush:
+            for assignee in list(self.assignees):
+                if assignee.name in names:
+                    names.remove(assignee.name)
+                else:
+                    self.assignees.remove(assignee)
+            for name in sorted(names):
+                self.assignees.append(TodoAssignee(name=name))
+
+    @staticmethod
+    def assigned_to(username):
+        return Todo.assignees.any(
+            TodoAssignee.name == normalize_assignee(username))
+
     def get_state(self):
         return "[{}]".format(self.get_state_plain())
 
@@ -752,7 +943,7 @@ class Todo(DatabaseModel):
 
     def is_new(self, current_protocol=None):
         if current_protocol is not None:
-            return self.get_first_protocol() == current_protocol
+            return self.first_protocol_id == current_protocol.id
         return len(self.protocols) == 1
 
     def render_html(self, current_protocol=None):
@@ -799,19 +990,111 @@ class Todo(DatabaseModel):
         return "[{}]".format(";".join(parts))
 
 
+@event.listens_for(Todo.who, "set")
+def on_todo_who_set(todo, value, oldvalue, initiator):
+    if value != oldvalue:
+        todo.update_assignees(value)
+
+
+ASSIGNEE_NAME_LENGTH = 128
+
+
+def normalize_assignee(name):
+    return name.lower().strip()[:ASSIGNEE_NAME_LENGTH]
+
+
+class TodoAssignee(DatabaseModel):
+    __tablename__ = "todoassignees"
+    todo_id = db.Column(
+        db.Integer, db.ForeignKey("todos.id"), primary_key=True)
+    name = db.Column(
+        db.String(ASSIGNEE_NAME_LENGTH), primary_key=True, index=True)
+
+
 class TodoProtocolAssociation(DatabaseModel):
     __tablename__ = "todoprotocolassociations"
     todo_id = db.Column(
         db.Integer, db.ForeignKey("todos.id"), primary_key=True)
     protocol_id = db.Column(
-        db.Integer, db.ForeignKey("protocols.id"), primary_key=True)
+        db.Integer, db.ForeignKey("protocols.id"), primary_key=True,
+        index=True)
+
+
+def _get_first_protocol_column(column):
+    return (
+        select(column)
+        .join(TodoProtocolAssociation,
+              TodoProtocolAssociation.protocol_id == Protocol.id)
+        .where(TodoProtocolAssociation.todo_id == Todo.id)
+        .order_by(Protocol.date, Protocol.id)
+        .limit(1)
+        .scalar_subquery())
+
+
+def update_first_protocols(connection, todo_ids):
+    """Recomputes Todo.first_protocol_id and first_protocol_date."""
+    connection.execute(
+        update(Todo)
+        .where(Todo.id.in_(todo_ids))
+        .values(
+            first_protocol_id=_get_first_protocol_column(Protocol.id),
+            first_protocol_date=_get_first_protocol_column(Protocol.date)))
+
+
+@event.listens_for(Session, "after_flush")
+def collect_first_protocol_changes(session, flush_context):
+    todo_ids = set()
+    dated_protocol_ids, deleted_protocol_ids = set(), set()
+    for instance in list(session.new) + list(session.dirty):
+        if isinstance(instance, Todo):
+            if inspect(instance).attrs.protocols.history.has_changes():
+                todo_ids.add(instance.id)
+        elif isinstance(instance, Protocol):
+            state = inspect(instance)
+            added, _, deleted = state.attrs.todos.history
+            todo_ids.update(todo.id for todo in added + deleted)
+            if state.attrs.date.history.has_changes():
+                dated_protocol_ids.add(instance.id)
+    for instance in session.deleted:
+        if isinstance(instance, Protocol):
+            deleted_protocol_ids.add(instance.id)
+        elif isinstance(instance, Todo):
+            todo_ids.add(instance.id)
+    connection = session.connection()
+    if dated_protocol_ids:
+        todo_ids.update(connection.scalars(
+            select(TodoProtocolAssociation.todo_id)
+            .where(TodoProtocolAssociation.protocol_id.in_(
+                dated_protocol_ids))))
+    if deleted_protocol_ids:
+        todo_ids.update(connection.scalars(
+            select(Todo.id)
+            .where(Todo.first_protocol_id.in_(deleted_protocol_ids))))
+    todo_ids.discard(None)
+    if todo_ids:
+        update_first_protocols(connection, todo_ids)
+        session.info.setdefault("first_protocol_todo_ids", set()).update(
+            todo_ids)
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def expire_first_protocols(session, flush_context):
+    todo_ids = session.info.pop("first_protocol_todo_ids", None)
+    if not todo_ids:
+        return
+    for instance in list(session.identity_map.values()):
+        if isinstance(instance, Todo) and instance.id in todo_ids:
+            session.expire(
+                instance, ["first_protocol_id", "first_protocol_date",
+                           "first_protocol"])
 
 
 class Decision(DatabaseModel):
     __tablename__ = "decisions"
     __model_name__ = "decision"
     id = db.Column(db.Integer, primary_key=True)
-    protocol_id = db.Column(db.Integer, db.ForeignKey("protocols.id"))
+    protocol_id = db.Column(
+        db.Integer, db.ForeignKey("protocols.id"), index=True)
     content = db.Column(db.Text)
 
     document = relationship(
@@ -845,7 +1128,8 @@ class DecisionCategoryAssociation(DatabaseModel):
     decision_id = db.Column(
         db.Integer, db.ForeignKey("decisions.id"), primary_key=True)
     decisioncategory_id = db.Column(
-        db.Integer, db.ForeignKey("decisioncategories.id"), primary_key=True)
+        db.Integer, db.ForeignKey("decisioncategories.id"), primary_key=True,
+        index=True)
 
 
 class MeetingReminder(DatabaseModel):
@@ -866,7 +1150,8 @@ class Error(DatabaseModel):
     __tablename__ = "errors"
     __model_name__ = "error"
     id = db.Column(db.Integer, primary_key=True)
-    protocol_id = db.Column(db.Integer, db.ForeignKey("protocols.id"))
+    protocol_id = db.Column(
+        db.Integer, db.ForeignKey("protocols.id"), index=True)
     action = db.Column(db.Text)
     name = db.Column(db.Text)
     datetime = db.Column(db.DateTime)
@@ -884,6 +1169,149 @@ class Error(DatabaseModel):
         return "\n".join(["\n".join(lines[:2]), "…", "\n".join(lines[-2:])])
 
 
+class WikiPush(DatabaseModel):
+    """The last content pushed to a wiki page.
+
+    Pages like the infobox are shared by all protocols of a type, so the
+    pushes are kept per type and page.
+    """
+    __tablename__ = "wikipushes"
+    __model_name__ = "wikipush"
+    protocoltype_id = db.Column(
+        db.Integer, db.ForeignKey("protocoltypes.id"), primary_key=True)
+    page = db.Column(db.String(255), primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    datetime = db.Column(db.DateTime)
+
+    def get_parent(self):
+        return self.protocoltype
+
+    @staticmethod
+    def hash_content(content):
+        return sha256(content.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_unchanged(protocoltype, page, content):
+        push = WikiPush.query.filter_by(
+            protocoltype_id=protocoltype.id, page=page).first()
+        return (push is not None
+                and push.content_hash == WikiPush.hash_content(content))
+
+    @staticmethod
+    def remember(protocoltype, page, content):
+        push = WikiPush.query.filter_by(
+            protocoltype_id=protocoltype.id, page=page).first()
+        if push is None:
+            push = WikiPush(protocoltype_id=protocoltype.id, page=page)
+            db.session.add(push)
+        push.content_hash = WikiPush.hash_content(content)
+        push.datetime = datetime.now()
+        db.session.commit()
+
+
+class ParseTiming(DatabaseModel):
+    __tablename__ = "parsetimings"
+    __model_name__ = "parsetiming"
+    id = db.Column(db.Integer, primary_key=True)
+    protocol_id = db.Column(db.Integer, db.ForeignKey("protocols.id"))
+    position = db.Column(db.Integer)
+    stage = db.Column(db.Text)
+    duration = db.Column(db.Float)
+    queries = db.Column(db.Integer)
+    datetime = db.Column(db.DateTime)
+
+    def get_parent(self):
+        return self.protocol
+
+    def to_dict(self):
+        return {
+            "protocol_id": self.protocol_id,
+            "datetime": self.datetime.isoformat(),
+            "stage": self.stage,
+            "duration": self.duration,
+            "queries": self.queries,
+        }
+
+
+class MetricsSnapshot(db.Model):
+    """The metrics last pushed by a worker process."""
+    __tablename__ = "metricssnapshots"
+    process = db.Column(db.String(255), primary_key=True)
+    content = db.Column(db.Text)
+    datetime = db.Column(db.DateTime)
+
+
+TASK_KEY_LENGTH = 255
+
+
+class PendingTask(db.Model):
+    """The newest request for a coalesced task.
+
+    A task started with an older token has been superseded and exits.
+    """
+    __tablename__ = "pendingtasks"
+    key = db.Column(db.String(TASK_KEY_LENGTH), primary_key=True)
+    token = db.Column(db.String(32), nullable=False)
+    datetime = db.Column(db.DateTime)
+
+    @staticmethod
+    def make_key(kind, *parts):
+        key = ":".join(map(str, (kind,) + parts))
+        if len(key) > TASK_KEY_LENGTH:
+            key = "{}:{}".format(kind, sha256(key.encode("utf-8")).hexdigest())
+        return key
+
+    @staticmethod
+    def register(key):
+        """Stores a new token for the key and returns it.
+
+        The token is committed on its own connection, the session of the
+        caller may hold uncommitted changes, e.g. half of a parse.
+        """
+        token = uuid4().hex
+        table = PendingTask.__table__
+        values = {"token": token, "datetime": datetime.now()}
+
+        def _store(connection):
+            updated = connection.execute(
+                table.update().where(table.c.key == key).values(values))
+            if updated.rowcount == 0:
+                connection.execute(table.insert().values(key=key, **values))
+
+        with db.engine.connect() as connection:
+            try:
+                with connection.begin():
+                    _store(connection)
+            except IntegrityError:
+                # registered concurrently, overwrite the other request
+                with connection.begin():
+                    _store(connection)
+        return token
+
+    @staticmethod
+    def is_current(key, token):
+        pending = PendingTask.query.filter_by(key=key).first()
+        return pending is None or pending.token == token
+
+
+class SearchEntry(db.Model):
+    """A searchable text of a protocol, decision or todo.
+
+    Maintained by the search module whenever these objects are flushed.
+    """
+    __tablename__ = "searchentries"
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(16), nullable=False)
+    object_id = db.Column(db.Integer, nullable=False)
+    field = db.Column(db.String(16), nullable=False)
+    content = db.Column(db.Text)
+    updated = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index("ix_searchentries_kind_object_id", "kind", "object_id"),
+    )
+
+
 class TodoMail(DatabaseModel):
     __tablename__ = "todomails"
     __model_name__ = "todomail"
@@ -904,6 +1332,11 @@ class OldTodo(DatabaseModel):
     description = db.Column(db.Text)
     protocol_key = db.Column(db.Text)
 
+    __table_args__ = (
+        db.Index("ix_oldtodos_protocol_key", "protocol_key",
+                 mysql_length=255),
+    )
+
 
 class DefaultMeta(DatabaseModel):
     __tablename__ = "defaultmetas"
@@ -983,3 +1416,31 @@ ALL_MODELS = [
     ProtocolType, Protocol, DefaultTOP, TOP, Document, DecisionDocument,
     Todo, Decision, MeetingReminder, Error, DefaultMeta, Meta, DecisionCategory
 ]
+
+
+@event.listens_for(Session, "after_flush")
+def bump_protocol_versions(session, flush_context):
+    """Counts the changes of the parts of the protocol page that are cached.
+
+    Changed default TOPs count as a change of every protocol of their type.
+    """
+    protocol_ids, protocoltype_ids = set(), set()
+    for instance in list(session.dirty) + list(session.deleted):
+        if isinstance(instance, Protocol):
+            protocol_ids.add(instance.id)
+    for instance in (
+            list(session.new) + list(session.dirty) + list(session.deleted)):
+        if isinstance(instance, (TOP, LocalTOP, Document)):
+            protocol_ids.add(instance.protocol_id)
+        elif isinstance(instance, DefaultTOP):
+            protocoltype_ids.add(instance.protocoltype_id)
+    protocol_ids.discard(None)
+    protocoltype_ids.discard(None)
+    if not protocol_ids and not protocoltype_ids:
+        return
+    session.connection().execute(
+        update(Protocol)
+        .where(or_(
+            Protocol.id.in_(protocol_ids),
+            Protocol.protocoltype_id.in_(protocoltype_ids)))
+        .values(version=Protocol.version + 1))
@@ -0,0 +1,109 @@
+"""Eager loading profiles for the views and tables.
+
+A profile bundles the loader options for the relationships a view or
+table touches per row, so that rendering it does not issue one lazy load
+per row and relationship.
+"""
+from sqlalchemy.orm import joinedload, selectinload
+
+from models.database import Protocol, ProtocolType, TOP, Todo, Decision
+
+
+def _protocols_table():
+    return [
+        joinedload(Protocol.protocoltype),
+        selectinload(Protocol.documents),
+    ]
+
+
+def _todos_table():
+    return [
+        joinedload(Todo.protocoltype),
+        selectinload(Todo.first_protocol).joinedload(Protocol.protocoltype),
+    ]
+
+
+def _decisions_table():
+    return [
+        joinedload(Decision.protocol).joinedload(Protocol.protocoltype),
+        selectinload(Decision.categories),
+        selectinload(Decision.document),
+    ]
+
+
+def _protocol_show():
+    return [
+        joinedload(Protocol.protocoltype),
+        selectinload(Protocol.tops).selectinload(TOP.likes),
+        selectinload(Protocol.localtops),
+        selectinload(Protocol.decisions).selectinload(Decision.likes),
+        selectinload(Protocol.decisions).selectinload(Decision.document),
+        selectinload(Protocol.documents),
+        selectinload(Protocol.errors),
+        selectinload(Protocol.metas),
+        selectinload(Protocol.likes),
+        selectinload(Protocol.parsetimings),
+        selectinload(Protocol.todos).selectinload(Todo.likes),
+    ]
+
+
+def _protocol_index():
+    return [
+        joinedload(Protocol.protocoltype),
+        selectinload(Protocol.tops).selectinload(TOP.likes),
+        selectinload(Protocol.decisions).selectinload(Decision.likes),
+        selectinload(Protocol.documents),
+        selectinload(Protocol.metas),
+    ]
+
+
+def _protocols_feed():
+    return [
+        joinedload(Protocol.protocoltype).selectinload(
+            ProtocolType.default_tops),
+        selectinload(Protocol.tops),
+        selectinload(Protocol.documents),
+        selectinload(Protocol.metas),
+    ]
+
+
+def _todo_show():
+    return [
+        joinedload(Todo.protocoltype),
+        selectinload(Todo.protocols).joinedload(Protocol.protocoltype),
+    ]
+
+
+PROFILES = {
+    "protocols_table": (Protocol, _protocols_table),
+    "todos_table": (Todo, _todos_table),
+    "decisions_table": (Decision, _decisions_table),
+    "protocol_show": (Protocol, _protocol_show),
+    "protocol_index": (Protocol, _protocol_index),
+    "todo_show": (Todo, _todo_show),
+    "protocols_feed": (Protocol, _protocols_feed),
+}
+_options = {}
+
+
+def get_model(profile):
+    return PROFILES[profile][0]
+
+
+def get_options(profile):
+    # built on first use, backrefs like Protocol.todos only exist once
+    # the mappers are configured
+    if profile not in _options:
+        _, make_options = PROFILES[profile]
+        _options[profile] = make_options()
+    return _options[profile]
+
+
+def load(instance, profile):
+    """Reloads an already loaded object with the options of a profile."""
+    model = get_model(profile)
+    return (
+        model.query.options(*get_options(profile))
+        .filter_by(id=instance.id)
+        .populate_existing()
+        .first())
@@ -0,0 +1,471 @@
+"""Full-text search over protocols, decisions and todos.
+
+The searchable texts are kept in the searchentries table, which is
+updated whenever one of the indexed objects is flushed. Each backend
+indexes this table its own way: Postgres with a GIN index on a tsvector,
+SQLite with a FTS5 table maintained by triggers and every other database
+with an inverted index in memory.
+
+Search terms are split like utils.split_terms does, so quoted terms are
+searched as phrases. Every term has to match, the last word of a term
+may be the prefix of a longer word.
+"""
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import namedtuple, OrderedDict
+from datetime import datetime
+from itertools import islice
+
+from markupsafe import escape
+
+from sqlalchemy import (
+    event, inspect, select, delete, insert, func, literal_column, text,
+    table, column)
+from sqlalchemy.orm import Session
+
+from shared import config
+from utils import split_terms
+from models.database import Protocol, Decision, Todo, SearchEntry
+from metrics import count_cache
+
+SearchResult = namedtuple("SearchResult", ["object_id", "field", "score"])
+
+KIND_PROTOCOL = "protocol"
+KIND_DECISION = "decision"
+KIND_TODO = "todo"
+
+INDEXED_ATTRIBUTES = {
+    Protocol: ("content_public", "content_private"),
+    Decision: ("content",),
+    Todo: ("who", "description"),
+}
+
+POSTGRES_TEXT_CONFIG = "german"
+SQLITE_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS searchindex USING fts5("
+    "content, content='searchentries', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS searchentries_ai "
+    "AFTER INSERT ON searchentries BEGIN "
+    "INSERT INTO searchindex(rowid, content) "
+    "VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS searchentries_ad "
+    "AFTER DELETE ON searchentries BEGIN "
+    "INSERT INTO searchindex(searchindex, rowid, content) "
+    "VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS searchentries_au "
+    "AFTER UPDATE ON searchentries BEGIN "
+    "INSERT INTO searchindex(searchindex, rowid, content) "
+    "VALUES ('delete', old.id, old.content); "
+    "INSERT INTO searchindex(rowid, content) "
+    "VALUES (new.id, new.content); END",
+]
+
+WORD_PATTERN = re.compile(r"\w+")
+
+SNIPPET_SCAN_LINES = 2000
+SNIPPET_MAX_LINES = 5
+SNIPPET_LINE_LENGTH = 160
+SNIPPET_CONTEXT = 40
+SNIPPET_CACHE_SIZE = 1024
+SNIPPET_SEPARATOR = " …<br />\n"
+
+
+def get_words(term):
+    return WORD_PATTERN.findall(term.lower())
+
+
+def get_searchable_texts(instance):
+    """Returns the kind and the searchable fields of an indexed object."""
+    if isinstance(instance, Protocol):
+        return KIND_PROTOCOL, {
+            "public": instance.content_public,
+            "private": instance.content_private,
+        }
+    elif isinstance(instance, Decision):
+        return KIND_DECISION, {"content": instance.content}
+    elif isinstance(instance, Todo):
+        return KIND_TODO, {
+            "content": "{} {}".format(
+                instance.who or "", instance.description or ""),
+        }
+    return None, None
+
+
+class SearchBackend:
+    name = None
+
+    @staticmethod
+    def is_available(connection):
+        return True
+
+    def prepare(self, connection):
+        pass
+
+    def update(self, connection, changed, removed):
+        """Replaces the entries of the changed and removed objects."""
+        keys = set(changed) | set(removed)
+        for kind in set(kind for kind, _ in keys):
+            object_ids = [object_id for key_kind, object_id in keys
+                          if key_kind == kind]
+            connection.execute(delete(SearchEntry.__table__).where(
+                SearchEntry.kind == kind,
+                SearchEntry.object_id.in_(object_ids)))
+        now = datetime.now()
+        rows = [
+            {"kind": kind, "object_id": object_id, "field": field,
+             "content": content, "updated": now}
+            for (kind, object_id), fields in changed.items()
+            for field, content in fields.items()
+        ]
+        if rows:
+            connection.execute(insert(SearchEntry.__table__), rows)
+
+    def search(self, connection, kind, terms, fields, limit, allowed=None):
+        raise NotImplementedError()
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Uses the GIN index ix_searchentries_tsvector."""
+    name = "postgres"
+
+    @staticmethod
+    def make_tsquery(terms):
+        parts = []
+        for term in terms:
+            words = ["'{}'".format(word) for word in get_words(term)]
+            if words:
+                parts.append("({}:*)".format(" <-> ".join(words)))
+        return " & ".join(parts)
+
+    def search(self, connection, kind, terms, fields, limit, allowed=None):
+        tsquery = self.make_tsquery(terms)
+        if not tsquery:
+            return []
+        # the text search configuration has to be a literal to match the
+        # expression of the index
+        text_config = literal_column(
+            "'{}'::regconfig".format(POSTGRES_TEXT_CONFIG))
+        vector = func.to_tsvector(text_config, SearchEntry.content)
+        query = func.to_tsquery(text_config, tsquery)
+        rank = func.ts_rank(vector, query)
+        statement = (
+            select(SearchEntry.object_id, SearchEntry.field, rank)
+            .where(SearchEntry.kind == kind,
+                   SearchEntry.field.in_(fields),
+                   vector.op("@@")(query)))
+        if allowed is not None:
+            statement = statement.where(SearchEntry.object_id.in_(allowed))
+        rows = connection.execute(
+            statement.order_by(rank.desc()).limit(limit))
+        return [SearchResult(*row) for row in rows]
+
+
+class SqliteSearchBackend(SearchBackend):
+    """Uses the FTS5 table searchindex."""
+    name = "sqlite"
+
+    def __init__(self):
+        self.prepared = False
+
+    @staticmethod
+    def is_available(connection):
+        options = connection.exec_driver_sql(
+            "PRAGMA compile_options").scalars().all()
+        return "ENABLE_FTS5" in options
+
+    def prepare(self, connection):
+        if self.prepared:
+            return
+        exists = connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE name = 'searchindex'"
+        ).first() is not None
+        for statement in SQLITE_SCHEMA:
+            connection.exec_driver_sql(statement)
+        if not exists:
+            connection.exec_driver_sql(
+                "INSERT INTO searchindex(searchindex) VALUES ('rebuild')")
+        self.prepared = True
+
+    @staticmethod
+    def make_match(terms):
+        return " ".join(
+            "\"{}\"*".format(" ".join(get_words(term)))
+            for term in terms if get_words(term))
+
+    def search(self, connection, kind, terms, fields, limit, allowed=None):
+        match = self.make_match(terms)
+        if not match:
+            return []
+        self.prepare(connection)
+        searchindex = table("searchindex", column("rowid"))
+        rank = literal_column("bm25(searchindex)").label("rank")
+        statement = (
+            select(SearchEntry.object_id, SearchEntry.field, rank)
+            .select_from(searchindex.join(
+                SearchEntry.__table__,
+                SearchEntry.id == searchindex.c.rowid))
+            .where(text("searchindex MATCH :match").bindparams(match=match),
+                   SearchEntry.kind == kind,
+                   SearchEntry.field.in_(fields)))
+        if allowed is not None:
+            statement = statement.where(SearchEntry.object_id.in_(allowed))
+        rows = connection.execute(statement.order_by(rank).limit(limit))
+        # bm25 is smaller for better matches
+        return [
+            SearchResult(object_id, field, -rank)
+            for object_id, field, rank in rows
+        ]
+
+
+class PythonSearchBackend(SearchBackend):
+    """An inverted index in memory, for databases without full-text search.
+
+    The index is rebuilt from the searchentries table when it has changed.
+    """
+    name = "python"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.signature = None
+        self.contents = {}
+        self.postings = {}
+        self.words = []
+
+    def _refresh(self, connection):
+        signature = tuple(connection.execute(select(
+            func.count(SearchEntry.id), func.max(SearchEntry.id),
+            func.max(SearchEntry.updated))).one())
+        if signature == self.signature:
+            return
+        contents = {}
+        postings = {}
+        rows = connection.execute(select(
+            SearchEntry.kind, SearchEntry.object_id, SearchEntry.field,
+            SearchEntry.content))
+        for kind, object_id, field, content in rows:
+            key = (kind, object_id, field)
+            contents[key] = (content or "").lower()
+            for word in set(get_words(contents[key])):
+                postings.setdefault(word, set()).add(key)
+        self.contents = contents
+        self.postings = postings
+        self.words = sorted(postings)
+        self.signature = signature
+
+    def _get_prefixed(self, prefix):
+        keys = set()
+        index = bisect_left(self.words, prefix)
+        while (index < len(self.words)
+                and self.words[index].startswith(prefix)):
+            keys |= self.postings[self.words[index]]
+            index += 1
+        return keys
+
+    def search(self, connection, kind, terms, fields, limit, allowed=None):
+        patterns = []
+        candidates = None
+        with self.lock:
+            self._refresh(connection)
+            for term in terms:
+                words = get_words(term)
+                if not words:
+                    continue
+                patterns.append(re.compile(
+                    r"\b" + r"\W+".join(map(re.escape, words))))
+                for word in words[:-1]:
+                    keys = self.postings.get(word, set())
+                    candidates = (
+                        keys if candidates is None else candidates & keys)
+                keys = self._get_prefixed(words[-1])
+                candidates = keys if candidates is None else candidates & keys
+            if candidates is None:
+                return []
+            results = []
+            for key in candidates:
+                key_kind, object_id, field = key
+                if key_kind != kind or field not in fields:
+                    continue
+                content = self.contents[key]
+                matches = 0
+                for pattern in patterns:
+                    count = len(pattern.findall(content))
+                    if count == 0:
+                        break
+                    matches += count
+                else:
+                    score = matches / math.log(len(content) + 2)
+                    results.append(SearchResult(object_id, field, score))
+        if allowed is not None and results:
+            allowed_ids = set(connection.execute(allowed).scalars())
+            results = [
+                result for result in results
+                if result.object_id in allowed_ids
+            ]
+        results.sort(key=lambda result: result.score, reverse=True)
+        return results[:limit]
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (PostgresSearchBackend, SqliteSearchBackend,
+                    PythonSearchBackend)
+}
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(connection):
+    """Returns the search backend for the database of the connection."""
+    dialect = connection.dialect.name
+    with _backends_lock:
+        if dialect not in _backends:
+            name = getattr(config, "SEARCH_BACKEND", "auto")
+            if name == "auto":
+                name = PythonSearchBackend.name
+                if dialect == "postgresql":
+                    name = PostgresSearchBackend.name
+                elif (dialect == "sqlite"
+                        and SqliteSearchBackend.is_available(connection)):
+                    name = SqliteSearchBackend.name
+            _backends[dialect] = BACKENDS[name]()
+        return _backends[dialect]
+
+
+def find(session, kind, search_term, fields, allowed=None):
+    """Returns the best matching fields of the given kind, best first.
+
+    allowed is a select of the ids of the objects to search in, e.g. those
+    visible to the user. SEARCH_MAX_RESULTS applies after it.
+    """
+    terms = split_terms(search_term)
+    if not terms:
+        return []
+    connection = session.connection()
+    limit = getattr(config, "SEARCH_MAX_RESULTS", 1000)
+    return get_backend(connection).search(
+        connection, kind, terms, fields, limit, allowed)
+
+
+def get_ranks(results, field=None):
+    """Maps the object ids of the results to their best score."""
+    ranks = {}
+    for result in results:
+        if field is None or result.field == field:
+            ranks[result.object_id] = max(
+                result.score, ranks.get(result.object_id, result.score))
+    return ranks
+
+
+def rebuild_index(session):
+    connection = session.connection()
+    backend = get_backend(connection)
+    connection.execute(delete(SearchEntry.__table__))
+    changed = {}
+    for model in INDEXED_ATTRIBUTES:
+        for instance in session.query(model).yield_per(100):
+            kind, fields = get_searchable_texts(instance)
+            changed[(kind, instance.id)] = fields
+    backend.update(connection, changed, [])
+    backend.prepare(connection)
+
+
+def _has_indexed_changes(instance):
+    attrs = inspect(instance).attrs
+    return any(
+        attrs[name].history.has_changes()
+        for name in INDEXED_ATTRIBUTES[type(instance)])
+
+
+@event.listens_for(Session, "after_flush")
+def update_index_after_flush(session, flush_context):
+    changed = {}
+    removed = []
+    for instance in session.new:
+        if type(instance) in INDEXED_ATTRIBUTES:
+            kind, fields = get_searchable_texts(instance)
+            changed[(kind, instance.id)] = fields
+    for instance in session.dirty:
+        if (type(instance) in INDEXED_ATTRIBUTES
+                and _has_indexed_changes(instance)):
+            kind, fields = get_searchable_texts(instance)
+            changed[(kind, instance.id)] = fields
+    for instance in session.deleted:
+        if type(instance) in INDEXED_ATTRIBUTES:
+            kind, _ = get_searchable_texts(instance)
+            removed.append((kind, instance.id))
+    if changed or removed:
+        connection = session.connection()
+        backend = get_backend(connection)
+        backend.prepare(connection)
+        backend.update(connection, changed, removed)
+
+
+class Highlighter:
+    """Marks the search terms in snippets of the matching lines.
+
+    The terms are compiled into one case-insensitive alternation, longer
+    terms first so that they win over their own prefixes.
+    """
+
+    def __init__(self, terms):
+        self.terms = tuple(sorted(
+            set(term.lower() for term in terms if term),
+            key=lambda term: (-len(term), term)))
+        self.pattern = None
+        if self.terms:
+            self.pattern = re.compile(
+                "|".join(map(re.escape, self.terms)), re.IGNORECASE)
+
+    def highlight_line(self, line, matches):
+        start = max(0, matches[0].start() - SNIPPET_CONTEXT)
+        end = min(len(line), start + SNIPPET_LINE_LENGTH)
+        parts = ["…"] if start > 0 else []
+        position = start
+        for match in matches:
+            if match.start() >= end:
+                break
+            match_end = min(match.end(), end)
+            parts.append(str(escape(line[position:match.start()])))
+            parts.append("<b>{}</b>".format(
+                escape(line[match.start():match_end])))
+            position = match_end
+        parts.append(str(escape(line[position:end])))
+        if end < len(line):
+            parts.append("…")
+        return "".join(parts)
+
+    def make_snippet(self, content):
+        if self.pattern is None or not content:
+            return ""
+        lines = []
+        for line in islice(content.splitlines(), SNIPPET_SCAN_LINES):
+            matches = list(self.pattern.finditer(line))
+            if matches:
+                lines.append(self.highlight_line(line, matches))
+                if len(lines) >= SNIPPET_MAX_LINES:
+                    break
+        return SNIPPET_SEPARATOR.join(lines)
+
+
+_snippets = OrderedDict()
+_snippets_lock = threading.Lock()
+
+
+def get_snippet(object_id, content, highlighter):
+    """Returns the highlighted snippet of the content, cached per query."""
+    content = content or ""
+    key = (object_id, len(content), hash(content), highlighter.terms)
+    with _snippets_lock:
+        snippet = _snippets.get(key)
+        if snippet is not None:
+            _snippets.move_to_end(key)
+    count_cache("search_snippets", snippet is not None)
+    if snippet is None:
+        snippet = highlighter.make_snippet(content)
+        with _snippets_lock:
+            _snippets[key] = snippet
+            while len(_snippets) > SNIPPET_CACHE_SIZE:
+                _snippets.popitem(last=False)
+    return snippet
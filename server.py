@@ -4,12 +4,16 @@ locale.setlocale(locale.LC_TIME, "de_DE.utf8")
 
 from flask import (
     Flask, request, session, flash, redirect,
-    url_for, abort, render_template, Response, Markup)
+    url_for, abort, render_template, Response, Markup, g,
+    has_request_context)
 import click
 from werkzeug.utils import secure_filename
 from flask_migrate import Migrate
 from celery import Celery
-from sqlalchemy import or_
+from celery.signals import before_task_publish, task_prerun, task_postrun
+from sqlalchemy import and_, or_, not_, case, event, func
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.engine import Engine
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 import atexit
@@ -20,24 +24,29 @@ import os
 from datetime import datetime, timedelta
 import math
 import mimetypes
+import json
+import time
 
 from shared import (
     config, db, date_filter, datetime_filter, date_filter_long,
     date_filter_short, time_filter, time_filter_short, user_manager,
-    security_manager, current_user, check_login, login_required,
+    security_manager, current_user, check_login, login_required, check_auth,
     class_filter, needs_date_test, todostate_name_filter,
-    code_filter, code_key_filter, indent_tab_filter)
+    code_filter, code_key_filter, indent_tab_filter, WikiType)
 from utils import (
     get_first_unused_int, get_etherpad_text, split_terms, optional_int_arg,
     fancy_join, footnote_hash, get_git_revision, get_max_page_length_exp,
-    get_internal_filename, get_current_ip)
+    get_internal_filename, get_current_ip, check_ip_in_networks,
+    QueryProfiler)
 from decorators import (
     require_private_view_right, require_modify_right, require_publish_right,
-    require_admin_right)
+    require_admin_right, load_profile)
+from models import profiles
 from models.database import (
     ProtocolType, Protocol, DefaultTOP, TOP, LocalTOP,
     Document, Todo, Decision, MeetingReminder, Error, TodoMail,
-    DecisionDocument, TodoState, DefaultMeta, DecisionCategory, Like)
+    DecisionDocument, TodoState, DefaultMeta, DecisionCategory, Like,
+    ParseTiming, MetricsSnapshot)
 from views.forms import (
     LoginForm, ProtocolTypeForm, DefaultTopForm,
     MeetingReminderForm, NewProtocolForm, DocumentUploadForm,
@@ -51,8 +60,13 @@ from views.tables import (
     ProtocolsTable, ProtocolTypesTable,
     ProtocolTypeTable, DefaultTOPsTable, MeetingRemindersTable, ErrorsTable,
     TodosTable, DocumentsTable, DecisionsTable, TodoTable, ErrorTable,
-    TodoMailsTable, DefaultMetasTable, DecisionCategoriesTable)
+    TodoMailsTable, DefaultMetasTable, DecisionCategoriesTable,
+    ParseTimingsTable)
 from legacy import import_old_todos, import_old_protocols, import_old_todomails
+import metrics
+import search
+import feeds
+import fragments
 from common import back
 from common.csrf import protect_csrf, get_csrf_token
 from common.database import db_lookup
@@ -99,6 +113,130 @@ def make_celery(app, config):
 
 celery = make_celery(app, config)
 
+
+def metrics_active():
+    return getattr(config, "METRICS_ACTIVE", False)
+
+
+_last_metrics_push = 0
+
+
+def push_metrics():
+    """Stores the metrics of this process for /metrics in other processes"""
+    global _last_metrics_push
+    now = time.monotonic()
+    if now - _last_metrics_push < config.METRICS_PUSH_INTERVAL:
+        return
+    _last_metrics_push = now
+    with app.app_context():
+        db.session.merge(MetricsSnapshot(
+            process=metrics.get_process_name(),
+            content=metrics.registry.dump(), datetime=datetime.now()))
+        db.session.commit()
+
+
+def profile_queries():
+    return getattr(config, "PROFILE_QUERIES", False)
+
+
+def _get_query_profiler():
+    if has_request_context():
+        return g.get("query_profiler")
+    return None
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_request_query(conn, cursor, statement, *args):
+    profiler = _get_query_profiler()
+    if profiler is not None:
+        profiler.before_execute(statement)
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def end_request_query(conn, cursor, statement, *args):
+    profiler = _get_query_profiler()
+    if profiler is not None:
+        profiler.after_execute(statement)
+
+
+@app.before_request
+def start_request_profiling():
+    if metrics_active() or profile_queries():
+        g.request_start = time.perf_counter()
+        g.query_profiler = QueryProfiler()
+
+
+@app.after_request
+def record_request_profile(response):
+    profiler = g.pop("query_profiler", None)
+    if profiler is None:
+        return response
+    route = (
+        request.url_rule.rule if request.url_rule is not None
+        else "unmatched")
+    duration = time.perf_counter() - g.request_start
+    if metrics_active():
+        metrics.REQUEST_DURATION.observe(
+            duration, route=route, method=request.method,
+            status=response.status_code)
+        metrics.REQUEST_QUERIES.observe(profiler.count, route=route)
+        push_metrics()
+    if profile_queries():
+        repeated = profiler.get_repeated(
+            getattr(config, "PROFILE_QUERIES_REPEAT_THRESHOLD", 5))
+        response.headers["X-Query-Count"] = str(profiler.count)
+        response.headers["X-Query-Time"] = "{:.1f}ms".format(
+            profiler.duration * 1000)
+        response.headers["X-Query-Repeated"] = str(len(repeated))
+        app.logger.info(
+            "%s %s: %d queries in %.1f ms, request took %.1f ms",
+            request.method, request.path, profiler.count,
+            profiler.duration * 1000, duration * 1000)
+        for statement, count, statement_duration in repeated:
+            app.logger.warning(
+                "Possible N+1 query in %s: %d times in %.1f ms: %s",
+                route, count, statement_duration * 1000,
+                " ".join(statement.split()))
+    return response
+
+
+def _get_timestamp(value):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.timestamp()
+
+
+@before_task_publish.connect
+def stamp_task_publish(headers=None, **kwargs):
+    if headers is not None:
+        headers["published_at"] = time.time()
+
+
+@task_prerun.connect
+def start_task_metrics(task=None, **kwargs):
+    if not metrics_active():
+        return
+    task.request.metrics_start = time.perf_counter()
+    published_at = task.request.get("published_at")
+    if published_at is None:
+        return
+    if task.request.eta:
+        # countdowns are intended, not waiting time
+        published_at = max(published_at, _get_timestamp(task.request.eta))
+    metrics.TASK_QUEUE_WAIT.observe(
+        max(0, time.time() - published_at), task=task.name)
+
+
+@task_postrun.connect
+def record_task_metrics(task=None, state=None, **kwargs):
+    start = getattr(task.request, "metrics_start", None)
+    if start is None:
+        return
+    metrics.TASK_DURATION.observe(
+        time.perf_counter() - start, task=task.name, state=state or "UNKNOWN")
+    push_metrics()
+
+
 app.jinja_env.trim_blocks = True
 app.jinja_env.lstrip_blocks = True
 app.jinja_env.filters["datify"] = date_filter
@@ -114,7 +252,7 @@ app.jinja_env.filters["code_key"] = code_key_filter
 app.jinja_env.filters["indent_tab"] = indent_tab_filter
 app.jinja_env.filters["fancy_join"] = fancy_join
 app.jinja_env.filters["footnote_hash"] = footnote_hash
-app.jinja_env.tests["auth_valid"] = security_manager.check_user
+app.jinja_env.tests["auth_valid"] = check_auth
 app.jinja_env.tests["needs_date"] = needs_date_test
 app.jinja_env.globals["get_csrf_token"] = get_csrf_token
 
@@ -148,11 +286,34 @@ def import_legacy():
 
 
 @app.cli.command()
-def recompile_all():
+@click.option("--force-push", is_flag=True,
+              help="Push to the wiki even if the pages are unchanged.")
+@click.option("--force", is_flag=True,
+              help="Parse even if source, parser and templates are unchanged.")
+def recompile_all(force_push, force):
     for protocol in sorted(Protocol.query.all(), key=lambda p: p.date):
         if protocol.is_done():
+            if (not force and not force_push
+                    and protocol.is_parsed_unchanged(
+                        tasks.PARSER_VERSION, tasks.TEMPLATE_VERSION)):
+                continue
             print(protocol.get_short_identifier())
-            tasks.parse_protocol(protocol)
+            tasks.parse_protocol(
+                protocol, force_push=force_push, force_parse=force)
+
+
+@app.cli.command()
+def export_parse_timings():
+    """Print the stored parse timings as JSON lines"""
+    for timing in ParseTiming.query.order_by(ParseTiming.id).all():
+        print(json.dumps(timing.to_dict()))
+
+
+@app.cli.command()
+def rebuild_search_index():
+    """Rebuild the full-text search index from scratch"""
+    search.rebuild_index(db.session)
+    db.session.commit()
 
 
 @app.cli.command()
@@ -204,71 +365,76 @@ def send_file(file_like, cache_timeout, as_attachment, attachment_filename):
     return response
 
 
+@app.route("/metrics")
+def show_metrics():
+    if (not metrics_active()
+            or not check_ip_in_networks(config.METRICS_ALLOWED_NETWORKS)):
+        abort(404)
+    process = metrics.get_process_name()
+    oldest = datetime.now() - timedelta(seconds=config.METRICS_MAX_AGE)
+    MetricsSnapshot.query.filter(MetricsSnapshot.datetime < oldest).delete()
+    db.session.commit()
+    sources = [(process, metrics.registry.collect())]
+    sources.extend(
+        (snapshot.process, json.loads(snapshot.content))
+        for snapshot in MetricsSnapshot.query.order_by(
+            MetricsSnapshot.process).all()
+        if snapshot.process != process)
+    return Response(
+        metrics.render(sources), content_type=metrics.CONTENT_TYPE)
+
+
 @app.route("/")
 @back.anchor
 def index():
     user = current_user()
-    protocols = [
-        protocol for protocol in Protocol.query.all()
-        if protocol.protocoltype.has_public_view_right(
-            user, check_networks=False)
-    ]
-
-    def _protocol_sort_key(protocol):
-        if protocol.date is not None:
-            return protocol.date
-        return datetime.now().date()
     current_day = datetime.now().date()
-    open_protocols = sorted(
-        [
-            protocol for protocol in protocols
-            if not protocol.done
-            and (protocol.date - current_day).days < config.MAX_INDEX_DAYS
-            and (current_day - protocol.date).days < config.MAX_PAST_INDEX_DAYS
-        ],
-        key=_protocol_sort_key
-    )
-    finished_protocols = sorted(
-        [
-            protocol for protocol in protocols
-            if protocol.done and protocol.public
-            and (
-                protocol.has_private_view_right(user)
-                or protocol.protocoltype.has_public_view_right(
-                    user, check_networks=False))
-        ],
-        key=_protocol_sort_key,
-        reverse=True
-    )
-    protocol = None
+    public_type_ids = ProtocolType.get_ids_with_right(
+        user, "public_view_anywhere")
+    open_protocols = (
+        Protocol.query
+        .options(joinedload(Protocol.protocoltype),
+                 selectinload(Protocol.likes))
+        .filter(
+            Protocol.protocoltype_id.in_(public_type_ids),
+            Protocol.done.is_(False),
+            Protocol.date < current_day + timedelta(
+                days=config.MAX_INDEX_DAYS),
+            Protocol.date > current_day - timedelta(
+                days=config.MAX_PAST_INDEX_DAYS))
+        .order_by(Protocol.date, Protocol.id)
+        .all())
+    protocol = (
+        Protocol.query
+        .options(*profiles.get_options("protocol_index"))
+        .filter(
+            Protocol.protocoltype_id.in_(public_type_ids),
+            Protocol.done.is_(True), Protocol.public.is_(True),
+            Protocol.date.isnot(None))
+        .order_by(Protocol.date.desc(), Protocol.id.desc())
+        .first())
     show_private = False
     has_public_view_right = False
-    if len(finished_protocols) > 0:
-        protocol = finished_protocols[0]
+    if protocol is not None:
         show_private = protocol.has_private_view_right(user)
         has_public_view_right = (
             protocol.protocoltype.has_public_view_right(user))
     todos = None
     if check_login():
-        todos = [
-            todo for todo in Todo.query.all()
-            if todo.protocoltype.has_private_view_right(user)
-            and not todo.is_done()
-        ]
-        user_todos = [
-            todo for todo in todos
-            if user.username.lower()
-            in list(map(str.strip, todo.who.lower().split(",")))
-        ]
-        if len(user_todos) > 0:
-            todos = user_todos
-
-        def _todo_sort_key(todo):
-            protocol = todo.get_first_protocol()
-            if protocol is not None and protocol.date is not None:
-                return protocol.date
-            return datetime.now().date()
-        todos = sorted(todos, key=_todo_sort_key, reverse=True)
+        private_type_ids = ProtocolType.get_ids_with_right(
+            user, "private_view")
+        todo_query = (
+            Todo.query
+            .options(joinedload(Todo.protocoltype),
+                     selectinload(Todo.likes))
+            .filter(Todo.is_open_clause(),
+                    Todo.protocoltype_id.in_(private_type_ids))
+            .order_by(
+                func.coalesce(Todo.first_protocol_date, current_day).desc(),
+                Todo.id))
+        todos = todo_query.filter(Todo.assigned_to(user.username)).all()
+        if len(todos) == 0:
+            todos = todo_query.all()
     return render_template(
         "index.html", open_protocols=open_protocols,
         protocol=protocol, todos=todos, show_private=show_private,
@@ -612,97 +778,56 @@ def list_protocols():
         search_form.state_open.data = state_open
     if search_term is not None:
         search_form.search.data = search_term
-    protocol_query = Protocol.query
     shall_search = search_term is not None and len(search_term.strip()) > 0
-    search_terms = []
-    if shall_search:
-        search_terms = list(map(str.lower, split_terms(search_term)))
-        for term in search_terms:
-            protocol_query = protocol_query.filter(or_(
-                Protocol.content_public.ilike("%{}%".format(term)),
-                Protocol.content_private.ilike("%{}%".format(term))
-            ))
-    protocols = [
-        protocol for protocol in protocol_query.all()
-        if protocol.protocoltype.has_public_view_right(
-            user, check_networks=False)
-    ]
-
-    def _matches_search(content):
-        content = content.lower()
-        for search_term in search_terms:
-            if search_term.lower() not in content:
-                return False
-        return True
-
-    def _matches_search_lazy(content):
-        content = content.lower()
-        for search_term in search_terms:
-            if search_term.lower() in content:
-                return True
-        return False
-    search_results = {} if shall_search else None
+    protocol_query = Protocol.query.filter(Protocol.protocoltype_id.in_(
+        [protocoltype.id for protocoltype in protocoltypes]))
     if protocoltype_id is not None and protocoltype_id != -1:
-        protocols = [
-            protocol for protocol in protocols
-            if protocol.protocoltype.id == protocoltype_id
-        ]
+        protocol_query = protocol_query.filter(
+            Protocol.protocoltype_id == protocoltype_id)
     if state_open is not None and state_open != -1:
-        protocol_done = bool(state_open)
-        protocols = [
-            protocol for protocol in protocols
-            if (protocol.is_done() or False) == protocol_done
-        ]
+        protocol_query = protocol_query.filter(
+            Protocol.done == bool(state_open))
+    ranks = {}
     if shall_search:
-        protocols = [
-            protocol for protocol in protocols
-            if (protocol.protocoltype.has_private_view_right(user)
-                and _matches_search(protocol.content_private))
-            or (protocol.has_public_view_right(user)
-                and _matches_search(protocol.content_public))
-        ]
-        for protocol in protocols:
-            content = protocol.get_visible_content(user)
-            lines = content.splitlines()
-            matches = [line for line in lines if _matches_search_lazy(line)]
-            formatted_lines = []
-            for line in matches:
-                parts = []
-                lower_line = line.lower()
-                last_index = 0
-                while last_index < len(line):
-                    index_candidates = list(filter(
-                        lambda t: t[0] != -1,
-                        [
-                            (lower_line.find(term, last_index), term)
-                            for term in search_terms
-                        ]))
-                    if len(index_candidates) == 0:
-                        parts.append((line[last_index:], False))
-                        break
-                    else:
-                        new_index, term = min(
-                            index_candidates, key=lambda t: t[0])
-                        new_end_index = new_index + len(term)
-                        parts.append((line[last_index:new_index], False))
-                        parts.append((line[new_index:new_end_index], True))
-                        last_index = new_end_index
-                formatted_lines.append("".join([
-                    "<b>{}</b>".format(text) if matched else text
-                    for text, matched in parts
-                ]))
-            search_results[protocol] = " …<br />\n".join(formatted_lines)
-    protocols = sorted(
-        protocols, key=lambda protocol: protocol.date, reverse=True)
-    page = _get_page()
-    page_length = _get_page_length()
-    page_count = int(math.ceil(len(protocols) / page_length))
-    if page >= page_count:
-        page = 0
-    begin_index = page * page_length
-    end_index = (page + 1) * page_length
-    max_page_length_exp = get_max_page_length_exp(protocols)
-    protocols = protocols[begin_index:end_index]
+        private_type_ids = ProtocolType.get_ids_with_right(
+            user, "private_view")
+        public_type_ids = ProtocolType.get_ids_with_right(
+            user, "public_view")
+        private_ids = (
+            protocol_query
+            .filter(Protocol.protocoltype_id.in_(private_type_ids))
+            .with_entities(Protocol.id).statement)
+        public_ids = (
+            protocol_query
+            .filter(Protocol.protocoltype_id.in_(public_type_ids),
+                    Protocol.public.is_(True))
+            .with_entities(Protocol.id).statement)
+        ranks = search.get_ranks(
+            search.find(
+                db.session, search.KIND_PROTOCOL, search_term,
+                ["private"], private_ids)
+            + search.find(
+                db.session, search.KIND_PROTOCOL, search_term,
+                ["public"], public_ids))
+        protocol_query = protocol_query.filter(Protocol.id.in_(list(ranks)))
+    protocol_query = protocol_query.options(
+        *profiles.get_options("protocols_table"))
+    if ranks:
+        protocol_query = protocol_query.order_by(
+            case(ranks, value=Protocol.id, else_=0).desc())
+    protocol_query = protocol_query.order_by(
+        Protocol.date.desc(), Protocol.id.desc())
+    protocols, page, page_length, page_count, max_page_length_exp = (
+        _paginate(protocol_query))
+
+    search_results = None
+    if shall_search:
+        highlighter = search.Highlighter(split_terms(search_term))
+        search_results = {
+            protocol: search.get_snippet(
+                protocol.id, protocol.get_visible_content(user), highlighter)
+            for protocol in protocols
+        }
     protocols_table = ProtocolsTable(protocols, search_results=search_results)
     return render_template(
         "protocols-list.html", protocols=protocols,
@@ -743,39 +868,77 @@ def new_protocol():
 @app.route("/protocol/show/<int:protocol_id>")
 @back.anchor
 @db_lookup(Protocol)
+@load_profile("protocol_show")
 def show_protocol(protocol):
     user = current_user()
-    errors_table = ErrorsTable(protocol.errors)
     if not protocol.protocoltype.has_public_view_right(
             user, check_networks=False):
         flash("Dir fehlen die nötigen Zugriffsrechte.", "alert-error")
         if check_login():
             return redirect(url_for("index"))
         return redirect(url_for("login"))
-    visible_documents = [
-        document for document in protocol.documents
-        if (not document.is_private
-            and document.protocol.has_public_view_right(user))
-        or (document.is_private
-            and document.protocol.protocoltype.has_private_view_right(user))
-    ]
-    documents_table = DocumentsTable(visible_documents, protocol)
-    document_upload_form = DocumentUploadForm()
-    source_upload_form = KnownProtocolSourceUploadForm()
+    has_modify_right = protocol.has_modify_right(user)
+    has_private_view_right = protocol.has_private_view_right(user)
+    errors_table = parse_timings_table = None
+    document_upload_form = source_upload_form = None
+    if has_modify_right:
+        errors_table = ErrorsTable(protocol.errors)
+        document_upload_form = DocumentUploadForm()
+        source_upload_form = KnownProtocolSourceUploadForm()
+    if protocol.has_admin_right(user):
+        parse_timings_table = ParseTimingsTable(protocol.parsetimings)
     time_diff = protocol.date - datetime.now().date()
     large_time_diff = not protocol.is_done() and time_diff.days > 0
     content_html = (
         protocol.content_html_private
-        if protocol.has_private_view_right(user)
+        if has_private_view_right
         else protocol.content_html_public)
     if content_html is not None:
         content_html = Markup(content_html)
+
+    def _render_tops():
+        return render_template(
+            "protocol-tops-include.html", protocol=protocol,
+            has_modify_right=has_modify_right,
+            has_private_view_right=has_private_view_right)
+
+    def _render_documents():
+        visible_documents = [
+            document for document in protocol.documents
+            if (not document.is_private
+                and document.protocol.has_public_view_right(user))
+            or (document.is_private
+                and document.protocol.protocoltype.has_private_view_right(
+                    user))
+        ]
+        return render_template(
+            "protocol-documents-include.html",
+            documents_table=DocumentsTable(visible_documents, protocol))
+
+    def _render_content():
+        return render_template(
+            "protocol-content-include.html", content_html=content_html)
+
+    renderers = {
+        "tops": _render_tops,
+        "documents": _render_documents,
+        "content": _render_content,
+    }
+    cache_fragments = fragments.is_cacheable(protocol, user)
+
+    def render_fragment(name):
+        if cache_fragments:
+            return fragments.get_fragment(
+                name, protocol, has_private_view_right, renderers[name])
+        return Markup(renderers[name]())
+
     return render_template(
         "protocol-show.html", protocol=protocol,
-        errors_table=errors_table, documents_table=documents_table,
+        errors_table=errors_table, parse_timings_table=parse_timings_table,
         document_upload_form=document_upload_form,
         source_upload_form=source_upload_form, time_diff=time_diff,
-        large_time_diff=large_time_diff, content_html=content_html)
+        large_time_diff=large_time_diff, content_html=content_html,
+        render_fragment=render_fragment)
 
 
 @app.route("/protocol/delete/<int:protocol_id>")
@@ -786,9 +949,14 @@ def show_protocol(protocol):
 @require_modify_right()
 def delete_protocol(protocol):
     name = protocol.get_short_identifier()
+    protocoltype = protocol.protocoltype
     protocol.delete_orphan_todos()
     db.session.delete(protocol)
     db.session.commit()
+    if (protocoltype.use_wiki
+            and WikiType[getattr(config, "WIKI_TYPE", "MEDIAWIKI")]
+            == WikiType.GITLAB_WIKI):
+        tasks.update_gitlab_wiki_index(protocoltype)
     flash("Protokoll {} ist gelöscht.".format(name), "alert-success")
     return back.redirect("list_protocols")
 
@@ -919,7 +1087,8 @@ def upload_new_protocol_by_file():
 @require_admin_right()
 @require_modify_right()
 def recompile_protocol(protocol):
-    tasks.parse_protocol(protocol)
+    force_push = request.args.get("force_push") == "1"
+    tasks.parse_protocol(protocol, force_push=force_push, force_parse=True)
     return back.redirect("show_protocol", protocol_id=protocol.id)
 
 
@@ -1148,6 +1317,20 @@ def _get_page_length():
         return config.PAGE_LENGTH
 
 
+def _paginate(query):
+    """Returns the requested page of the query and its pagination state."""
+    page = _get_page()
+    page_length = max(_get_page_length(), 1)
+    total = query.order_by(None).count()
+    page_count = int(math.ceil(total / page_length))
+    if page < 0 or page >= page_count:
+        page = 0
+    items = query.offset(page * page_length).limit(page_length).all()
+    return (
+        items, page, page_length, page_count,
+        get_max_page_length_exp(total))
+
+
 @app.route("/todos/list")
 @back.anchor
 @login_required
@@ -1172,40 +1355,31 @@ def list_todos():
         search_form.state_open.data = state_open
     if search_term is not None:
         search_form.search.data = search_term
-    todos = [
-        todo for todo in Todo.query.all()
-        if todo.protocoltype.has_public_view_right(user)
-    ]
+    todo_query = Todo.query.filter(Todo.protocoltype_id.in_(
+        [protocoltype.id for protocoltype in protocoltypes]))
     if protocoltype_id is not None and protocoltype_id != -1:
-        todos = [
-            todo for todo in todos
-            if todo.protocoltype.id == protocoltype_id
-        ]
+        todo_query = todo_query.filter(
+            Todo.protocoltype_id == protocoltype_id)
+    is_open = Todo.is_open_clause()
     if state_open is not None and state_open != -1:
-        todo_done = bool(state_open)
-        todos = [
-            todo for todo in todos
-            if todo.is_done() == todo_done
-        ]
+        if state_open:
+            todo_query = todo_query.filter(not_(is_open))
+        else:
+            todo_query = todo_query.filter(is_open)
     if search_term is not None and len(search_term.strip()) > 0:
-        todos = [
-            todo for todo in todos
-            if search_term.lower() in todo.description.lower()
-            or search_term.lower() in todo.who.lower()
-        ]
-
-    def _sort_key(todo):
-        return (not todo.is_done(), todo.get_id())
-    todos = sorted(todos, key=_sort_key, reverse=True)
-    page = _get_page()
-    page_length = _get_page_length()
-    page_count = int(math.ceil(len(todos) / page_length))
-    if page >= page_count:
-        page = 0
-    begin_index = page * page_length
-    end_index = (page + 1) * page_length
-    max_page_length_exp = get_max_page_length_exp(todos)
-    todos = todos[begin_index:end_index]
+        ranks = search.get_ranks(search.find(
+            db.session, search.KIND_TODO, search_term, ["content"],
+            todo_query.with_entities(Todo.id).statement))
+        todo_query = todo_query.filter(Todo.id.in_(list(ranks)))
+        if ranks:
+            todo_query = todo_query.order_by(
+                case(ranks, value=Todo.id, else_=0).desc())
+    todo_query = todo_query.options(*profiles.get_options("todos_table"))
+    todo_query = todo_query.order_by(
+        case((is_open, 1), else_=0).desc(),
+        func.coalesce(Todo.number, Todo.id).desc())
+    todos, page, page_length, page_count, max_page_length_exp = (
+        _paginate(todo_query))
     todos_table = TodosTable(todos)
     return render_template(
         "todos-list.html", todos=todos,
@@ -1279,6 +1453,7 @@ def edit_todo(todo):
 @login_required
 @db_lookup(Todo)
 @require_private_view_right()
+@load_profile("todo_show")
 def show_todo(todo):
     todo_table = TodoTable(todo)
     return render_template("todo-show.html", todo=todo, todo_table=todo_table)
@@ -1338,11 +1513,9 @@ def list_decisions():
     search_term = request.args.get("search")
     protocoltypes = ProtocolType.get_public_protocoltypes(
         user, check_networks=False)
-    decisioncategories = [
-        category
-        for protocoltype in protocoltypes
-        for category in protocoltype.decisioncategories
-    ]
+    decisioncategories = DecisionCategory.query.filter(
+        DecisionCategory.protocoltype_id.in_(
+            [protocoltype.id for protocoltype in protocoltypes])).all()
     search_form = DecisionSearchForm(protocoltypes, decisioncategories)
     if protocoltype_id is not None:
         search_form.protocoltype_id.data = protocoltype_id
@@ -1350,37 +1523,37 @@ def list_decisions():
         search_form.decisioncategory_id.data = decisioncategory_id
     if search_term is not None:
         search_form.search.data = search_term
-    decisions = [
-        decision for decision in Decision.query.all()
-        if decision.protocol.has_public_view_right(user)
-    ]
+    public_type_ids = ProtocolType.get_ids_with_right(user, "public_view")
+    private_type_ids = ProtocolType.get_ids_with_right(user, "private_view")
+    decision_query = (
+        Decision.query
+        .join(Decision.protocol)
+        .filter(or_(
+            and_(Protocol.public.is_(True),
+                 Protocol.protocoltype_id.in_(public_type_ids)),
+            Protocol.protocoltype_id.in_(private_type_ids))))
     if protocoltype_id is not None and protocoltype_id != -1:
-        decisions = [
-            decision for decision in decisions
-            if decision.protocol.protocoltype.id == protocoltype_id
-        ]
+        decision_query = decision_query.filter(
+            Protocol.protocoltype_id == protocoltype_id)
     if decisioncategory_id is not None and decisioncategory_id != -1:
-        decisions = [
-            decision for decision in decisions
-            if decisioncategory_id in map(lambda d: d.id, decision.categories)
-        ]
+        decision_query = decision_query.filter(
+            Decision.categories.any(
+                DecisionCategory.id == decisioncategory_id))
     if search_term is not None and len(search_term.strip()) > 0:
-        decisions = [
-            decision for decision in decisions
-            if search_term.lower() in decision.content.lower()
-        ]
-    decisions = sorted(decisions, key=lambda d: d.protocol.date, reverse=True)
-
-    page = _get_page()
-    page_length = _get_page_length()
-
-    page_count = int(math.ceil(len(decisions) / page_length))
-    if page >= page_count:
-        page = 0
-    begin_index = page * page_length
-    end_index = (page + 1) * page_length
-    max_page_length_exp = get_max_page_length_exp(decisions)
-    decisions = decisions[begin_index:end_index]
+        ranks = search.get_ranks(search.find(
+            db.session, search.KIND_DECISION, search_term, ["content"],
+            decision_query.with_entities(Decision.id).statement))
+        decision_query = decision_query.filter(
+            Decision.id.in_(list(ranks)))
+        if ranks:
+            decision_query = decision_query.order_by(
+                case(ranks, value=Decision.id, else_=0).desc())
+    decision_query = decision_query.options(
+        *profiles.get_options("decisions_table"))
+    decision_query = decision_query.order_by(
+        Protocol.date.desc(), Decision.id)
+    decisions, page, page_length, page_count, max_page_length_exp = (
+        _paginate(decision_query))
     decisions_table = DecisionsTable(decisions)
     return render_template(
         "decisions-list.html", decisions=decisions,
@@ -1717,13 +1890,25 @@ def delete_decisioncategory(decisioncategory):
     return back.redirect("show_type", protocoltype_id=type_id)
 
 
-def create_protocols_feed(protocoltype):
+def get_feed_protocols(protocoltypes, done=None):
+    query = Protocol.query.options(
+        *profiles.get_options("protocols_feed")).filter(
+        Protocol.protocoltype_id.in_(
+            [protocoltype.id for protocoltype in protocoltypes]))
+    if done is not None:
+        query = query.filter(Protocol.done == done)
+    return (
+        query.order_by(Protocol.date.desc(), Protocol.id.desc())
+        .limit(feeds.get_max_entries()).all())
+
+
+def check_public_feed(protocoltype):
     if not protocoltype.has_public_anonymous_view_right():
         abort(403)
-    protocols = [
-        protocol for protocol in protocoltype.protocols
-        if protocol.is_done()
-    ]
+
+
+def create_protocols_feed(protocoltype):
+    protocols = get_feed_protocols([protocoltype], done=True)
     feed = feedgen.feed.FeedGenerator()
     feed.description(protocoltype.name)
     feed.generator(
@@ -1756,12 +1941,7 @@ def create_protocols_feed(protocoltype):
 
 
 def create_appointments_feed(protocoltype):
-    if not protocoltype.has_public_anonymous_view_right():
-        abort(403)
-    protocols = [
-        protocol for protocol in protocoltype.protocols
-        if not protocol.is_done()
-    ]
+    protocols = get_feed_protocols([protocoltype], done=False)
     feed = feedgen.feed.FeedGenerator()
     feed.description(protocoltype.name)
     feed.generator(
@@ -1802,70 +1982,75 @@ def create_appointments_feed(protocoltype):
 @app.route("/feed/protocols/rss/<int:protocoltype_id>")
 @db_lookup(ProtocolType)
 def feed_protocols_rss(protocoltype):
-    return Response(
-        create_protocols_feed(protocoltype).rss_str(),
-        mimetype="application/rss+xml")
+    check_public_feed(protocoltype)
+    return feeds.make_response(
+        "protocols-rss", [protocoltype], "application/rss+xml",
+        lambda: create_protocols_feed(protocoltype).rss_str())
 
 
 @app.route("/feed/protocols/atom/<int:protocoltype_id>")
 @db_lookup(ProtocolType)
 def feed_protocols_atom(protocoltype):
-    return Response(
-        create_protocols_feed(protocoltype).atom_str(),
-        mimetype="application/atom+xml")
+    check_public_feed(protocoltype)
+    return feeds.make_response(
+        "protocols-atom", [protocoltype], "application/atom+xml",
+        lambda: create_protocols_feed(protocoltype).atom_str())
 
 
 @app.route("/feed/appointments/rss/<int:protocoltype_id>")
 @db_lookup(ProtocolType)
 def feed_appointments_rss(protocoltype):
-    return Response(
-        create_appointments_feed(protocoltype).rss_str(),
-        mimetype="application/rss+xml")
+    check_public_feed(protocoltype)
+    return feeds.make_response(
+        "appointments-rss", [protocoltype], "application/rss+xml",
+        lambda: create_appointments_feed(protocoltype).rss_str())
 
 
 @app.route("/feed/appointments/atom/<int:protocoltype_id>")
 @db_lookup(ProtocolType)
 def feed_appointments_atom(protocoltype):
-    return Response(
-        create_appointments_feed(protocoltype).atom_str(),
-        mimetype="application/atom+xml")
+    check_public_feed(protocoltype)
+    return feeds.make_response(
+        "appointments-atom", [protocoltype], "application/atom+xml",
+        lambda: create_appointments_feed(protocoltype).atom_str())
 
 
-def make_calendar_from_protocols(protocols, summary):
+def make_calendar_from_protocols(events, summary):
     calendar = icalendar.Calendar()
     calendar["summary"] = summary
     calendar["prodid"] = "Protokollsystem 3"
     calendar["version"] = "2.0"
-    for protocol in protocols:
+
+    def to_datetime(value):
+        # the TZID is set directly, icalendar would use the abbreviation
+        datetime_prop = icalendar.prop.vDatetime(value.replace(tzinfo=None))
+        datetime_prop.params["TZID"] = feeds.get_timezone_id(value)
+        return datetime_prop
+
+    for calendar_event in events:
         event = icalendar.Event()
-        event["uid"] = protocol.id
-        to_datetime = icalendar.prop.vDatetime
-        start = protocol.get_timezone_aware_start_date()
+        event["uid"] = calendar_event.protocol_id
+        start = calendar_event.start
         event["dtstamp"] = to_datetime(start)
         event["dtstart"] = to_datetime(start)
         event["dtend"] = to_datetime(start + timedelta(hours=3))
-        event["summary"] = protocol.protocoltype.short_name
-        event["description"] = "\n".join(
-            top.name for top in protocol.get_tops() if top.name is not None)
+        event["summary"] = calendar_event.summary
+        event["description"] = "\n".join(calendar_event.top_names)
         calendar.add_component(event)
-    content = calendar.to_ical().decode("utf-8")
-    for key in config.CALENDAR_TIMEZONE_MAP:
-        content = content.replace(
-            "TZID={}:".format(key),
-            "TZID={}:".format(config.CALENDAR_TIMEZONE_MAP[key]))
-    return Response(content.encode("utf-8"), mimetype="text/calendar")
+    return calendar.to_ical()
 
 
 @app.route("/feed/appointments/ical/<int:protocoltype_id>")
 @db_lookup(ProtocolType)
 def feed_appointments_ical(protocoltype):
-    if not protocoltype.has_public_anonymous_view_right():
-        abort(403)
-    protocols = [
-        protocol for protocol in protocoltype.protocols
-        if not protocol.is_done()
-    ]
-    return make_calendar_from_protocols(protocols, protocoltype.short_name)
+    check_public_feed(protocoltype)
+    return feeds.make_response(
+        "appointments-ical", [protocoltype], "text/calendar",
+        lambda: make_calendar_from_protocols(
+            feeds.load_calendar_events(
+                [protocoltype.id], done=False,
+                since=feeds.get_calendar_start()),
+            protocoltype.short_name))
 
 
 @app.route("/feed/appointments/ical/")
@@ -1876,12 +2061,13 @@ def feed_all_appointments_ical():
         if (protocoltype.has_private_view_right(user)
             or protocoltype.has_public_view_right(user)
             or protocoltype.is_public)]
-    protocols = [
-        protocol
-        for protocoltype in types
-        for protocol in protocoltype.protocols
-    ]
-    return make_calendar_from_protocols(protocols, "Sitzungskalender")
+    return feeds.make_response(
+        "all-appointments-ical", types, "text/calendar",
+        lambda: make_calendar_from_protocols(
+            feeds.load_calendar_events(
+                [protocoltype.id for protocoltype in types],
+                since=feeds.get_calendar_start()),
+            "Sitzungskalender"))
 
 
 @app.route("/like/new")
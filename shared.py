@@ -1,5 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
-from flask import session, redirect, url_for, flash
+from flask import session, redirect, url_for, flash, g, has_request_context
 
 import re
 from functools import wraps
@@ -141,12 +141,33 @@ def check_login():
     return current_user() is not None
 
 
+def check_auth(hashstring):
+    """Verifies a session hash, once per request."""
+    if not has_request_context():
+        return security_manager.check_user(hashstring)
+    checked = g.setdefault("checked_auth", {})
+    if hashstring not in checked:
+        checked[hashstring] = security_manager.check_user(hashstring)
+    return checked[hashstring]
+
+
 def current_user():
-    if "auth" not in session:
-        return None
-    if not security_manager.check_user(session["auth"]):
-        return None
-    return User.from_hashstring(session["auth"])
+    """Returns the logged in user, resolved once per request.
+
+    The user is stored together with the session hash it was resolved
+    from, logging in or out changes the hash and resolves it again.
+    """
+    auth = session.get("auth")
+    if has_request_context():
+        cached = g.get("current_user")
+        if cached is not None and cached[0] == auth:
+            return cached[1]
+    user = None
+    if auth is not None and check_auth(auth):
+        user = User.from_hashstring(auth)
+    if has_request_context():
+        g.current_user = (auth, user)
+    return user
 
 
 def login_required(function):
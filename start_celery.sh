@@ -1,2 +1,49 @@
 #!/bin/bash
-uv run celery -A server.celery worker --loglevel=debug --concurrency=1
+# Usage: ./start_celery.sh [all|pools|parse|latex|io]
+#
+# "all" (the default) starts a single worker for every queue, which is
+# enough for development. "pools" starts one worker per queue, each with
+# its own concurrency, prefetch and time limits, so a LaTeX backlog or a
+# hanging wiki does not delay parsing.
+CELERY=${CELERY:-"uv run celery"}
+WORKER="$CELERY -A server.celery worker --loglevel=${LOGLEVEL:-debug}"
+
+start_all() {
+    $WORKER -Q parse,latex,io,celery --concurrency=1
+}
+
+start_parse() {
+    $WORKER -n parse@%h -Q parse \
+        --concurrency=${PARSE_CONCURRENCY:-2} --prefetch-multiplier=1 \
+        --soft-time-limit=60 --time-limit=90
+}
+
+start_latex() {
+    $WORKER -n latex@%h -Q latex \
+        --concurrency=${LATEX_CONCURRENCY:-$(nproc)} --prefetch-multiplier=1 \
+        --soft-time-limit=240 --time-limit=300
+}
+
+start_io() {
+    $WORKER -n io@%h -Q io,celery \
+        --concurrency=${IO_CONCURRENCY:-8} --prefetch-multiplier=4 \
+        --soft-time-limit=120 --time-limit=150
+}
+
+case "${1:-all}" in
+    all) start_all ;;
+    parse) start_parse ;;
+    latex) start_latex ;;
+    io) start_io ;;
+    pools)
+        trap 'kill $(jobs -p) 2>/dev/null' EXIT
+        start_parse &
+        start_latex &
+        start_io &
+        wait
+        ;;
+    *)
+        echo "Usage: $0 [all|pools|parse|latex|io]" >&2
+        exit 1
+        ;;
+esac
@@ -7,12 +7,18 @@ import tempfile
 from datetime import datetime, timedelta
 import time
 import traceback
+import hashlib
+import json
+import logging
 from copy import copy
 import xmlrpc.client
 
+from sqlalchemy import func
+
 from models.database import (
     Document, Protocol, Todo, Decision, TOP, MeetingReminder,
-    TodoMail, DecisionDocument, TodoState, OldTodo, DecisionCategory)
+    TodoMail, DecisionDocument, TodoState, OldTodo, DecisionCategory,
+    TodoAssignee, WikiPush, ProtocolType, PendingTask, ParseTiming)
 from models.errors import DateNotMatchingException
 from server import celery, app
 from shared import (
@@ -20,11 +26,22 @@ from shared import (
     date_filter_short, time_filter, class_filter, KNOWN_KEYS, WikiType, config)
 from utils import (
     mail_manager, add_line_numbers,
-    set_etherpad_text, parse_datetime_from_string)
+    set_etherpad_text, parse_datetime_from_string, StageTimer)
+import protoparser
 from protoparser import parse, ParserException, Tag, Remark, Fork, RenderType
-from wiki import WikiClient, WikiException
+from wiki import get_wiki_client, WikiException
 from calendarpush import Client as CalendarClient, CalendarException
 from legacy import lookup_todo_id
+from metrics import (
+    count_cache, WIKI_PUSH_DURATION, XELATEX_DURATION)
+
+timings_logger = logging.getLogger("tasks.parsetimings")
+
+# see start_celery.sh for the workers consuming these queues
+QUEUE_PARSE = "parse"
+QUEUE_LATEX = "latex"
+QUEUE_IO = "io"
+
 
 texenv = app.create_jinja_environment()
 texenv.block_start_string = r"\ENV{"
@@ -153,22 +170,101 @@ def _make_error(protocol, *args):
     db.session.commit()
 
 
-ID_FIELD_BEGINNING = "id "
+def _delay_coalesced(task, key, *args, **kwargs):
+    kwargs["coalesce_key"] = key
+    kwargs["coalesce_token"] = PendingTask.register(key)
+    task.apply_async(
+        args, kwargs, countdown=getattr(config, "CELERY_COALESCE_DELAY", 3))
+
+
+def _flag_parts(**flags):
+    # a request must not drop the flags of the request it supersedes, so
+    # requests with different flags are coalesced separately
+    return [name for name, value in sorted(flags.items()) if value]
+
 
+def _is_superseded(coalesce_key, coalesce_token):
+    return (coalesce_token is not None
+            and not PendingTask.is_current(coalesce_key, coalesce_token))
 
-def parse_protocol(protocol, ignore_old_date=False):
-    parse_protocol_async.delay(protocol.id, ignore_old_date)
+
+ID_FIELD_BEGINNING = "id "
 
 
-@celery.task
-def parse_protocol_async(protocol_id, ignore_old_date=False):
+# settings that change what parsing a protocol renders and pushes
+PARSE_SETTINGS = [
+    "FONTS", "HTML_LEVEL_OFFSET", "LATEX_ADDITIONAL_PACKAGES",
+    "LATEX_BULLETPOINTS", "LATEX_GEOMETRY", "LATEX_HEADER_FOOTER",
+    "LATEX_LOGO_TEMPLATE", "LATEX_PAGESTYLE", "LATEX_TEMPLATES",
+    "PARSER_LAZY", "PRIVATE_KEYWORDS", "RENDERING_MD", "RENDERING_PDF",
+    "WIKI_ACTIVE", "WIKI_TYPE",
+]
+
+
+def _hash_files(paths, settings=None):
+    digest = hashlib.sha256()
+    if settings is not None:
+        digest.update(json.dumps(
+            settings, sort_keys=True, default=repr).encode("utf-8"))
+    for path in paths:
+        digest.update(path.encode("utf-8"))
+        with open(path, "rb") as hashed_file:
+            digest.update(hashed_file.read())
+    return digest.hexdigest()
+
+
+def _get_template_paths():
+    template_dirs = [os.path.join(app.root_path, app.template_folder)]
+    # the templates of LATEX_TEMPLATES are folders in this directory
+    local_templates = getattr(config, "LATEX_LOCAL_TEMPLATES", None)
+    if local_templates is not None and os.path.isdir(local_templates):
+        template_dirs.append(local_templates)
+    return sorted(
+        os.path.join(root, filename)
+        for template_dir in template_dirs
+        for root, _, filenames in os.walk(template_dir)
+        for filename in filenames)
+
+
+PARSER_VERSION = _hash_files(
+    [protoparser.__file__, __file__],
+    {name: getattr(config, name, None) for name in PARSE_SETTINGS})
+TEMPLATE_VERSION = _hash_files(_get_template_paths())
+
+
+def parse_protocol(protocol, ignore_old_date=False, force_push=False,
+                   force_parse=False):
+    _delay_coalesced(
+        parse_protocol_async,
+        PendingTask.make_key(
+            "parse", protocol.id, *_flag_parts(
+                ignore_old_date=ignore_old_date, force_push=force_push,
+                force_parse=force_parse)),
+        protocol.id, ignore_old_date, force_push, force_parse)
+
+
+@celery.task(queue=QUEUE_PARSE)
+def parse_protocol_async(protocol_id, ignore_old_date=False, force_push=False,
+                         force_parse=False, coalesce_key=None,
+                         coalesce_token=None):
     with app.app_context():
+        if _is_superseded(coalesce_key, coalesce_token):
+            return
         with app.test_request_context("/"):
             try:
                 protocol = Protocol.first_by_id(protocol_id)
                 if protocol is None:
                     raise Exception("No protocol given. Aborting parsing.")
-                parse_protocol_async_inner(protocol, ignore_old_date)
+                if not force_parse and not force_push:
+                    unchanged = protocol.is_parsed_unchanged(
+                        PARSER_VERSION, TEMPLATE_VERSION)
+                    count_cache("parse", unchanged)
+                    if unchanged:
+                        return
+                with StageTimer(db.engine) as timer:
+                    parse_protocol_async_inner(
+                        protocol, ignore_old_date, force_push, timer)
+                _store_parse_timings(protocol, timer)
                 if protocol.date is None :
                     initialdate = datetime.now().date()
                     protocol.date = initialdate
@@ -181,7 +277,24 @@ def parse_protocol_async(protocol_id, ignore_old_date=False):
                     "{}\n\n{}".format(str(exc), stacktrace))
 
 
-def parse_protocol_async_inner(protocol, ignore_old_date=False):
+def _store_parse_timings(protocol, timer):
+    now = datetime.now()
+    protocol.parsetimings = [
+        ParseTiming(
+            position=position, stage=stage, duration=duration,
+            queries=queries, datetime=now)
+        for position, (stage, duration, queries) in enumerate(timer.stages)
+    ]
+    db.session.commit()
+    for timing in protocol.parsetimings:
+        timings_logger.info(json.dumps(timing.to_dict()))
+
+
+def parse_protocol_async_inner(protocol, ignore_old_date=False,
+                               force_push=False, timer=None):
+    if timer is None:
+        timer = StageTimer(db.engine)
+    timer.start("setup")
     old_errors = list(protocol.errors)
     for error in old_errors:
         protocol.errors.remove(error)
@@ -192,6 +305,7 @@ def parse_protocol_async_inner(protocol, ignore_old_date=False):
         return _make_error(
             protocol, "Parsing", "The etherpad is unmodified and does not "
             "contain a protocol.", protocol.source)
+    timer.start("parse")
     tree = None
     try:
         tree = parse(protocol.source)
@@ -207,6 +321,7 @@ def parse_protocol_async_inner(protocol, ignore_old_date=False):
         if exc.tree is not None:
             context += "\n\nParsed syntax tree was:\n" + str(exc.tree.dump())
         return _make_error(protocol, "Parsing", str(exc), context)
+    timer.start("metadata")
     remarks = {
         element.name: element
         for element in tree.children
@@ -249,6 +364,7 @@ def parse_protocol_async_inner(protocol, ignore_old_date=False):
                 if exc.protocol_date is not None
                 else "not present"))
     # tags
+    timer.start("tags")
     tags = tree.get_tags()
     public_elements = tree.get_visible_elements(show_private=False)
     for tag in tags:
@@ -259,6 +375,7 @@ def parse_protocol_async_inner(protocol, ignore_old_date=False):
                 "not defined. This is probably an error mit a missing "
                 "semicolon.".format(tag.linenumber, tag.name))
     # todos
+    timer.start("todos")
     old_todo_number_map = {}
     for todo in protocol.todos:
         old_todo_number_map[todo.description] = todo.get_id()
@@ -394,6 +511,7 @@ def parse_protocol_async_inner(protocol, ignore_old_date=False):
         db.session.commit()
         todo_tag.todo = todo
     # Decisions
+    timer.start("decisions")
     decision_tags = [tag for tag in tags if tag.name == "beschluss"]
     for decision_tag in decision_tags:
         if decision_tag not in public_elements:
@@ -469,6 +587,7 @@ def parse_protocol_async_inner(protocol, ignore_old_date=False):
     ]
 
     # new Protocols
+    timer.start("protocols")
     protocol_tags = [tag for tag in tags if tag.name == "sitzung"]
     for protocol_tag in protocol_tags:
         if len(protocol_tag.values) not in {1, 2}:
@@ -511,6 +630,7 @@ def parse_protocol_async_inner(protocol, ignore_old_date=False):
             Protocol.create_new_protocol(protocol.protocoltype, new_protocol_date)
 
     # TOPs
+    timer.start("tops")
     old_tops = list(protocol.tops)
     tops = []
     for index, fork in enumerate(
@@ -530,6 +650,7 @@ def parse_protocol_async_inner(protocol, ignore_old_date=False):
     db.session.commit()
 
     # render
+    timer.start("render")
     private_render_kwargs = {
         "protocol": protocol,
         "tree": tree,
@@ -558,6 +679,7 @@ def parse_protocol_async_inner(protocol, ignore_old_date=False):
         "protocol.html", render_type=RenderType.html, show_private=False,
         **public_render_kwargs)
 
+    timer.start("compile")
     for show_private in privacy_states:
         latex_source = texenv.get_template(provide_latex_template(
             protocol.protocoltype.latex_template, "protocol")).render(
@@ -599,6 +721,7 @@ def parse_protocol_async_inner(protocol, ignore_old_date=False):
 
 
     if protocol.protocoltype.use_wiki:
+        timer.start("wiki")
         wiki_type = WikiType[getattr(config, "WIKI_TYPE", "MEDIAWIKI")]
         wiki_template = {
             WikiType.MEDIAWIKI: "protocol.wiki",
@@ -628,58 +751,94 @@ def parse_protocol_async_inner(protocol, ignore_old_date=False):
                 protocoltype=protocol.protocoltype)
             push_to_wiki(
                 protocol, wiki_source, wiki_infobox_source,
-                "Automatisch generiert vom Protokollsystem 3.0")
+                "Automatisch generiert vom Protokollsystem 3.0", force_push)
         elif wiki_type == WikiType.DOKUWIKI:
             push_to_dokuwiki(
                 protocol, wiki_source,
-                "Automatisch generiert vom Protokollsystem 3.0")
+                "Automatisch generiert vom Protokollsystem 3.0", force_push)
         elif wiki_type == WikiType.GITLAB_WIKI:
-            push_to_gitlab_wiki(protocol, wiki_source, "Automatisch generiert vom Protokollsystem 3.0")
+            push_to_gitlab_wiki(protocol, wiki_source, "Automatisch generiert vom Protokollsystem 3.0", force_push)
+    timer.start("finish")
     protocol.done = True
+    protocol.mark_parsed(PARSER_VERSION, TEMPLATE_VERSION)
     db.session.commit()
 
 
-def push_to_wiki(protocol, content, infobox_content, summary):
-    push_to_wiki_async.delay(protocol.id, content, infobox_content, summary)
+def _needs_push(protocol, page, content, force_push):
+    if force_push:
+        return True
+    unchanged = WikiPush.is_unchanged(
+        protocol.protocoltype, page, content)
+    count_cache("wikipush", unchanged)
+    return not unchanged
+
 
+def push_to_wiki(protocol, content, infobox_content, summary,
+                 force_push=False):
+    _delay_coalesced(
+        push_to_wiki_async,
+        PendingTask.make_key(
+            "wiki", protocol.id, *_flag_parts(force_push=force_push)),
+        protocol.id, content, infobox_content, summary, force_push)
 
-@celery.task
-def push_to_wiki_async(protocol_id, content, infobox_content, summary):
+
+@celery.task(queue=QUEUE_IO)
+def push_to_wiki_async(protocol_id, content, infobox_content, summary,
+                       force_push=False, coalesce_key=None,
+                       coalesce_token=None):
     with app.app_context():
+        if _is_superseded(coalesce_key, coalesce_token):
+            return
         protocol = Protocol.query.filter_by(id=protocol_id).first()
+        pages = [
+            (protocol.protocoltype.get_wiki_infobox_title(), infobox_content),
+            (protocol.get_wiki_title(), content),
+        ]
         try:
-            with WikiClient() as wiki_client:
-                wiki_client.edit_page(
-                    title=protocol.protocoltype.get_wiki_infobox_title(),
-                    content=infobox_content,
-                    summary=summary)
-                wiki_client.edit_page(
-                    title=protocol.get_wiki_title(),
-                    content=content,
-                    summary=summary)
+            wiki_client = get_wiki_client()
+            for title, page_content in pages:
+                if not _needs_push(protocol, title, page_content, force_push):
+                    continue
+                with WIKI_PUSH_DURATION.time(wiki="mediawiki"):
+                    wiki_client.edit_page(
+                        title=title, content=page_content, summary=summary)
+                WikiPush.remember(protocol.protocoltype, title, page_content)
         except WikiException as exc:
             return _make_error(
                 protocol, "Pushing to Wiki", "Pushing to Wiki failed.",
                 str(exc))
 
 
-def push_to_dokuwiki(protocol, content, summary):
-    push_to_dokuwiki_async.delay(protocol.id, content, summary)
+def push_to_dokuwiki(protocol, content, summary, force_push=False):
+    _delay_coalesced(
+        push_to_dokuwiki_async,
+        PendingTask.make_key(
+            "wiki", protocol.id, *_flag_parts(force_push=force_push)),
+        protocol.id, content, summary, force_push)
 
 
-@celery.task
-def push_to_dokuwiki_async(protocol_id, content, summary):
+@celery.task(queue=QUEUE_IO)
+def push_to_dokuwiki_async(protocol_id, content, summary, force_push=False,
+                           coalesce_key=None, coalesce_token=None):
     with app.app_context():
+        if _is_superseded(coalesce_key, coalesce_token):
+            return
         protocol = Protocol.query.filter_by(id=protocol_id).first()
+        pagetitle = protocol.get_dokuwiki_pagetitle()
+        if not _needs_push(protocol, pagetitle, content, force_push):
+            return None
         with xmlrpc.client.ServerProxy(config.WIKI_API_URL) as proxy:
             try:
-                if not proxy.wiki.putPage(
-                    protocol.get_dokuwiki_pagetitle(), content,
-                    {"sum":
-                        "Automatisch generiert vom Protokollsystem 3."}):
+                with WIKI_PUSH_DURATION.time(wiki="dokuwiki"):
+                    saved = proxy.wiki.putPage(
+                        pagetitle, content,
+                        {"sum":
+                            "Automatisch generiert vom Protokollsystem 3."})
+                if not saved:
                     return _make_error(
                         protocol, "Pushing to Wiki",
                         "Pushing to Wiki failed." "")
+                WikiPush.remember(protocol.protocoltype, pagetitle, content)
             except xmlrpc.client.ProtocolError as prot_err: # makes sure the WIKI_API_URL does not get leaked
                 error_msg = "A ProtocolError occurred with code:'{}'; and Message:'{}'".format(
                     prot_err.errcode, prot_err.errmsg)
@@ -692,84 +851,166 @@ def push_to_dokuwiki_async(protocol_id, content, summary):
                     str(exception))
 
 
-def push_to_gitlab_wiki(protocol, content, summary):
-    push_to_gitlab_wiki_async.delay(protocol.id, content, summary)
+def push_to_gitlab_wiki(protocol, content, summary, force_push=False):
+    _delay_coalesced(
+        push_to_gitlab_wiki_async,
+        PendingTask.make_key(
+            "wiki", protocol.id, *_flag_parts(force_push=force_push)),
+        protocol.id, content, summary, force_push)
+
+
+_gitlab_clients = {}
+_gitlab_index_hashes = {}
 
 
-@celery.task
-def push_to_gitlab_wiki_async(protocol_id, content, summary):
+def _get_gitlab_project(protocoltype):
+    import gitlab
+
+    private_token = protocoltype.gitlab_api_token or config.WIKI_PASSWORD
+    key = (config.WIKI_API_URL, private_token)
+    if key not in _gitlab_clients:
+        _gitlab_clients[key] = gitlab.Gitlab(
+            config.WIKI_API_URL, private_token=private_token)
+    return _gitlab_clients[key].projects.get(
+        protocoltype.gitlab_project_id, lazy=True)
+
+
+def _save_gitlab_wiki_page(project, title, content):
+    import gitlab
+
+    try:
+        page = project.wikis.get(title)
+        page.content = content
+        page.title = title
+        page.save()
+    except (gitlab.GitlabGetError, AttributeError):
+        project.wikis.create({
+            "title": title,
+            "content": content,
+        })
+
+
+@celery.task(queue=QUEUE_IO)
+def push_to_gitlab_wiki_async(protocol_id, content, summary, force_push=False,
+                              coalesce_key=None, coalesce_token=None):
     import gitlab
-    import urllib.parse
 
     with app.app_context():
+        if _is_superseded(coalesce_key, coalesce_token):
+            return
         protocol = Protocol.query.filter_by(id=protocol_id).first()
-        gl = gitlab.Gitlab(config.WIKI_API_URL, private_token=protocol.protocoltype.gitlab_api_token or config.WIKI_PASSWORD)
-        if gl is None:
-            return _make_error(protocol, "Pushing to GitLab Wiki", "Pushing to GitLab Wiki failed.", "Unable to create API object.")
-        try:
-            project = gl.projects.get(protocol.protocoltype.gitlab_project_id)
-            category_page = project.wikis.get(protocol.protocoltype.wiki_category)
-            all_protocols = Protocol.query.filter_by(protocoltype=protocol.protocoltype).order_by(Protocol.date.desc()).all()
-            category_page.content = render_template("protocol-index.md", protocols=all_protocols)
-            category_page.title = protocol.protocoltype.wiki_category
-            category_page.save()
-            protocol_title = protocol.get_gitlab_wiki_pagetitle()
-            try:
-                current_page = project.wikis.get(protocol_title)
-                current_page.content = content
-                current_page.title = protocol_title
-                current_page.save()
-            except (gitlab.GitlabGetError, AttributeError):
-                project.wikis.create({
-                    "title": protocol_title,
-                    "content": content,
-                })
+        protocol_title = protocol.get_gitlab_wiki_pagetitle()
+        if not _needs_push(protocol, protocol_title, content, force_push):
             return None
+        try:
+            project = _get_gitlab_project(protocol.protocoltype)
+            with WIKI_PUSH_DURATION.time(wiki="gitlab"):
+                _save_gitlab_wiki_page(project, protocol_title, content)
+            WikiPush.remember(
+                protocol.protocoltype, protocol_title, content)
         except gitlab.GitlabError as e:
             return _make_error(protocol, "Pushing to GitLab Wiki", "Pushing to GitLab Wiki", str(e))
+        update_gitlab_wiki_index(protocol.protocoltype, protocol)
+
+
+def update_gitlab_wiki_index(protocoltype, protocol=None):
+    update_gitlab_wiki_index_async.apply_async(
+        (protocoltype.id, protocol.id if protocol is not None else None,
+         time.time()),
+        countdown=getattr(config, "WIKI_INDEX_DELAY", 30))
+
+
+@celery.task(queue=QUEUE_IO)
+def update_gitlab_wiki_index_async(protocoltype_id, protocol_id, requested):
+    import gitlab
 
+    with app.app_context():
+        protocoltype = ProtocolType.first_by_id(protocoltype_id)
+        if protocoltype is None:
+            return None
+        newer_push = (
+            WikiPush.query
+            .filter(WikiPush.protocoltype_id == protocoltype_id,
+                    WikiPush.datetime > datetime.fromtimestamp(requested))
+            .first())
+        if newer_push is not None:
+            # the newer push has scheduled its own index update
+            return None
+        content = render_template(
+            "protocol-index.md", protocoltype=protocoltype,
+            entries=protocoltype.get_gitlab_wiki_index_entries())
+        content_hash = WikiPush.hash_content(content)
+        unchanged = _gitlab_index_hashes.get(protocoltype_id) == content_hash
+        count_cache("gitlabindex", unchanged)
+        if unchanged:
+            return None
+        try:
+            project = _get_gitlab_project(protocoltype)
+            with WIKI_PUSH_DURATION.time(wiki="gitlab"):
+                _save_gitlab_wiki_page(
+                    project, protocoltype.get_gitlab_wiki_category(), content)
+        except gitlab.GitlabError as e:
+            protocol = Protocol.first_by_id(protocol_id)
+            if protocol is None:
+                raise
+            return _make_error(protocol, "Pushing to GitLab Wiki", "Pushing the category index failed", str(e))
+        _gitlab_index_hashes[protocoltype_id] = content_hash
 
 
+def _compile_key(kind, object_id, use_decision=False, show_private=False,
+                 extra_name=""):
+    return PendingTask.make_key(
+        kind, "decision" if use_decision else "protocol", object_id,
+        "private" if show_private else "public", extra_name)
+
 def compile(content, protocol, show_private, maxdepth):
     if not getattr(config, "RENDERING_PDF", True):
         return
-    compile_async.delay(
+    _delay_coalesced(
+        compile_async, _compile_key("compile", protocol.id, show_private=show_private),
         content, protocol.id, show_private=show_private, maxdepth=maxdepth)
 
 def compile_decision(content, decision, maxdepth):
     if not getattr(config, "RENDERING_PDF", True):
         return
-    compile_async.delay(
+    _delay_coalesced(
+        compile_async, _compile_key("compile", decision.id, use_decision=True),
         content, decision.id, use_decision=True, maxdepth=maxdepth)
 
 def compile_extra(content, protocol, show_private, maxdepth, extra_name):
     if not getattr(config, "RENDERING_PDF", True):
         return
-    compile_async.delay(
+    _delay_coalesced(
+        compile_async, _compile_key("compile", protocol.id, show_private=show_private, extra_name=extra_name),
         content, protocol.id, use_decision=False, show_private=show_private, maxdepth=maxdepth, is_extra=True, extra_name=extra_name)
 
 def compile_md(content, protocol, show_private, maxdepth):
     if not getattr(config, "RENDERING_MD", False):
         return
-    compile_md_async.delay(
+    _delay_coalesced(
+        compile_md_async, _compile_key("compile-md", protocol.id, show_private=show_private),
         content, protocol.id, show_private=show_private, maxdepth=maxdepth)
 
 def compile_decision_md(content, decision, maxdepth):
     if not getattr(config, "RENDERING_MD", False):
         return
-    compile_md_async.delay(
+    _delay_coalesced(
+        compile_md_async, _compile_key("compile-md", decision.id, use_decision=True),
         content, decision.id, use_decision=True, maxdepth=maxdepth)
 
 def compile_extra_md(content, protocol, show_private, maxdepth, extra_name):
     if not getattr(config, "RENDERING_MD", False):
         return
-    compile_md_async.delay(
+    _delay_coalesced(
+        compile_md_async, _compile_key("compile-md", protocol.id, show_private=show_private, extra_name=extra_name),
         content, protocol.id, use_decision=False, show_private=show_private, maxdepth=maxdepth, is_extra=True, extra_name=extra_name)
 
-@celery.task
+@celery.task(queue=QUEUE_PARSE)
 def compile_md_async(content, protocol_id, show_private=False, use_decision=False, is_extra=False, extra_name="",
-        maxdepth=5):
+        maxdepth=5, coalesce_key=None, coalesce_token=None):
     with app.app_context():
+        if _is_superseded(coalesce_key, coalesce_token):
+            return
         decision = None
         protocol = None
         if use_decision:
@@ -826,11 +1067,13 @@ def compile_md_async(content, protocol_id, show_private=False, use_decision=Fals
             fp.write(content)
         db.session.commit()
 
-@celery.task
+@celery.task(queue=QUEUE_LATEX)
 def compile_async(
         content, protocol_id, show_private=False, use_decision=False, is_extra=False, extra_name="",
-        maxdepth=5):
+        maxdepth=5, coalesce_key=None, coalesce_token=None):
     with tempfile.TemporaryDirectory() as compile_dir, app.app_context():
+        if _is_superseded(coalesce_key, coalesce_token):
+            return
         decision = None
         protocol = None
         if use_decision:
@@ -865,12 +1108,13 @@ def compile_async(
                 "-file-line-error",
                 protocol_source_filename
             ]
-            subprocess.check_call(
-                command, universal_newlines=True, stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL)
-            subprocess.check_call(
-                command, universal_newlines=True, stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL)
+            with XELATEX_DURATION.time():
+                subprocess.check_call(
+                    command, universal_newlines=True,
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                subprocess.check_call(
+                    command, universal_newlines=True,
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
             os.chdir(current)
             document = None
             if not use_decision and not is_extra:
@@ -957,7 +1201,7 @@ def print_file(filename, protocol):
         print_file_async.delay(filename, protocol.id)
 
 
-@celery.task
+@celery.task(queue=QUEUE_IO)
 def print_file_async(filename, protocol_id):
     with app.app_context():
         protocol = Protocol.query.filter_by(id=protocol_id).first()
@@ -994,7 +1238,7 @@ def send_reminder(reminder, protocol):
     send_reminder_async.delay(reminder.id, protocol.id)
 
 
-@celery.task
+@celery.task(queue=QUEUE_IO)
 def send_reminder_async(reminder_id, protocol_id):
     with app.app_context():
         reminder = MeetingReminder.query.filter_by(id=reminder_id).first()
@@ -1017,7 +1261,7 @@ def remind_finishing(protocol, delay_days, min_delay_days):
     remind_finishing_async.delay(protocol.id, delay_days, min_delay_days)
 
 
-@celery.task
+@celery.task(queue=QUEUE_IO)
 def remind_finishing_async(protocol_id, delay_days, min_delay_days):
     with app.app_context():
         protocol = Protocol.first_by_id(protocol_id)
@@ -1040,7 +1284,7 @@ def send_protocol_public(protocol):
     send_protocol_async.delay(protocol.id, show_private=False)
 
 
-@celery.task
+@celery.task(queue=QUEUE_IO)
 def send_protocol_async(protocol_id, show_private):
     with app.app_context():
         protocol = Protocol.query.filter_by(id=protocol_id).first()
@@ -1066,20 +1310,18 @@ def send_protocol_async(protocol_id, show_private):
         send_mail(protocol, to_addr, subject, mail_content, appendix)
 
 
-@celery.task
+@celery.task(queue=QUEUE_IO)
 def send_todomails_async(protocol_id):
     with app.app_context():
         protocol = Protocol.query.filter_by(id=protocol_id).first()
-        all_todos = [
-            todo for todo in Todo.query.all()
-            if not todo.is_done()
-            and todo.protocoltype == protocol.protocoltype
-        ]
-        users = {user for todo in all_todos for user in todo.get_users()}
-        grouped_todos = {
-            user: [todo for todo in all_todos if user in todo.get_users()]
-            for user in users
-        }
+        assigned_todos = db.session.query(TodoAssignee.name, Todo).join(
+            Todo, TodoAssignee.todo_id == Todo.id).filter(
+            Todo.protocoltype_id == protocol.protocoltype_id,
+            Todo.is_open_clause()).order_by(Todo.id).all()
+        grouped_todos = {}
+        for user, todo in assigned_todos:
+            grouped_todos.setdefault(user, []).append(todo)
+        users = list(grouped_todos)
         subject = "Du hast noch was zu tun!"
         todomail_providers = getattr(
             config, "ADDITIONAL_TODOMAIL_PROVIDERS", None)
@@ -1091,8 +1333,14 @@ def send_todomails_async(protocol_id):
                     if key not in additional_todomails:
                         name, mail = todomail_dict[key]
                         additional_todomails[key] = TodoMail(name, mail)
+        todomails = {
+            todomail.name.lower(): todomail
+            for todomail in TodoMail.query.filter(
+                func.lower(TodoMail.name).in_(users)).all()
+        } if users else {}
+        mails = []
         for user in users:
-            todomail = TodoMail.query.filter(TodoMail.name.ilike(user)).first()
+            todomail = todomails.get(user)
             if todomail is None:
                 if user in additional_todomails:
                     todomail = additional_todomails[user]
@@ -1105,9 +1353,10 @@ def send_todomails_async(protocol_id):
             mail_content = render_template(
                 "todo-mail.txt", protocol=protocol, todomail=todomail,
                 todos=grouped_todos[user])
-            send_mail(
-                protocol, to_addr, subject, mail_content,
-                reply_to=protocol.protocoltype.private_mail)
+            mails.append((
+                to_addr, subject, mail_content, None,
+                protocol.protocoltype.private_mail))
+        send_mails(protocol, mails)
 
 
 def send_mail(protocol, to_addr, subject, content, appendix=None,
@@ -1117,7 +1366,7 @@ def send_mail(protocol, to_addr, subject, content, appendix=None,
             protocol.id, to_addr, subject, content, appendix, reply_to)
 
 
-@celery.task
+@celery.task(queue=QUEUE_IO)
 def send_mail_async(protocol_id, to_addr, subject, content, appendix,
                     reply_to):
     with app.app_context():
@@ -1129,15 +1378,44 @@ def send_mail_async(protocol_id, to_addr, subject, content, appendix,
                 protocol, "Sending Mail", "Sending mail failed", str(exc))
 
 
+def send_mails(protocol, mails):
+    mails = [
+        mail for mail in mails
+        if mail[0] is not None and len(mail[0].strip()) > 0
+    ]
+    if mails:
+        send_mails_async.delay(protocol.id, mails)
+
+
+@celery.task(queue=QUEUE_IO)
+def send_mails_async(protocol_id, mails):
+    with app.app_context():
+        protocol = Protocol.query.filter_by(id=protocol_id).first()
+        try:
+            failures = mail_manager.send_batch(mails)
+        except Exception as exc:
+            return _make_error(
+                protocol, "Sending Mail", "Sending mails failed", str(exc))
+        for to_addr, exc in failures:
+            _make_error(
+                protocol, "Sending Mail",
+                "Sending mail to {} failed".format(to_addr), str(exc))
+
+
 def push_tops_to_calendar(protocol):
-    push_tops_to_calendar_async.delay(protocol.id)
+    _delay_coalesced(
+        push_tops_to_calendar_async,
+        PendingTask.make_key("calendar", protocol.id), protocol.id)
 
 
-@celery.task
-def push_tops_to_calendar_async(protocol_id):
+@celery.task(queue=QUEUE_IO)
+def push_tops_to_calendar_async(protocol_id, coalesce_key=None,
+                                coalesce_token=None):
     if not config.CALENDAR_ACTIVE:
         return
     with app.app_context():
+        if _is_superseded(coalesce_key, coalesce_token):
+            return
         protocol = Protocol.query.filter_by(id=protocol_id).first()
         if protocol.protocoltype.calendar == "":
             return
@@ -1159,7 +1437,7 @@ def set_etherpad_content(protocol):
     set_etherpad_content_async.apply_async((protocol.id,), countdown=15)
 
 
-@celery.task
+@celery.task(queue=QUEUE_IO)
 def set_etherpad_content_async(protocol_id):
     with app.app_context():
         protocol = Protocol.query.filter_by(id=protocol_id).first()
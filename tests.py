@@ -4,9 +4,30 @@ import unittest
 import tempfile
 import server as proto3
 from flask_migrate import upgrade as db_upgrade
-from models.database import ProtocolType, Protocol, DefaultTOP, TOP, Document, DecisionDocument, TodoState, Todo, Decision, MeetingReminder, Error, TodoMail, OldTodo, DefaultMeta, Meta
+from models.database import ProtocolType, Protocol, DefaultTOP, TOP, LocalTOP, Document, DecisionDocument, TodoState, Todo, Decision, MeetingReminder, Error, TodoMail, OldTodo, DefaultMeta, Meta, PendingTask, WikiPush
 
 import sqlite3
+import socket
+from datetime import date, datetime, time, timedelta
+
+from configproxy import Config
+from utils import MailManager, StageTimer, NetworkAllowlist
+from wiki import WikiClient
+from metrics import Registry, render as render_metrics
+from sqlalchemy import select
+import search
+from search import (
+    PostgresSearchBackend, SqliteSearchBackend, PythonSearchBackend,
+    Highlighter)
+import feeds
+import fragments
+import icalendar
+from fragments import MemoryFragmentBackend
+
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
 
 def _create_db(sql_script, database_file):
     connection = sqlite3.connect(database_file)
@@ -35,6 +56,33 @@ class GeneralTestCase(unittest.TestCase):
         with proto3.app.app_context():
             _upgrade_db(self.program_dir)
         
+    def _count_queries(self, route):
+        profile_queries = getattr(proto3.config, "PROFILE_QUERIES", False)
+        proto3.config.PROFILE_QUERIES = True
+        try:
+            response = self.app.get(route)
+        finally:
+            proto3.config.PROFILE_QUERIES = profile_queries
+        return response, int(response.headers["X-Query-Count"])
+
+    def _assert_query_budget(self, route, budget):
+        response, query_count = self._count_queries(route)
+        assert query_count <= budget, (
+            "{} ran {} queries, the budget is {}".format(
+                route, query_count, budget))
+        return response
+
+    def _assert_queries_independent_of_rows(self, route):
+        """A page of many rows has to run as many queries as one of few."""
+        separator = "&" if "?" in route else "?"
+        _, few = self._count_queries(
+            "{}{}page_length=2".format(route, separator))
+        _, many = self._count_queries(
+            "{}{}page_length=50".format(route, separator))
+        assert few == many, (
+            "{} ran {} queries for 2 rows, {} for 50 rows".format(
+                route, few, many))
+
     def _general_teardown(self):
         self.tempdir.cleanup()
         os.chdir(self.program_dir)
@@ -79,6 +127,22 @@ class FullDBAnonymousTestCase(GeneralTestCase):
             assert get_result.status_code == expected_get
             assert post_result.status_code == expected_post
 
+    QUERY_BUDGETS = {
+        "/": 11,
+        "/protocols/list": 5,
+        "/decisions/list": 8,
+        "/feed/appointments/ical/": 20,
+    }
+
+    def test_query_budgets(self):
+        for route, budget in self.QUERY_BUDGETS.items():
+            self._assert_query_budget(route, budget)
+
+    def test_list_queries_independent_of_rows(self):
+        for route in ["/protocols/list", "/decisions/list",
+                      "/protocols/list?search=protokoll"]:
+            self._assert_queries_independent_of_rows(route)
+
     def test_protocoltypes(self):
         with proto3.app.app_context():
             new_route = "/type/new"
@@ -120,5 +184,695 @@ class FullDBAnonymousTestCase(GeneralTestCase):
                 
                 
 
+    def test_ids_with_right_are_loaded_once_per_request(self):
+        with proto3.app.test_request_context():
+            with StageTimer(proto3.db.engine) as timer:
+                timer.start("rights")
+                for _ in range(2):
+                    public = ProtocolType.get_ids_with_right(
+                        None, "public_view_anywhere")
+                    private = ProtocolType.get_ids_with_right(
+                        None, "private_view")
+            assert timer.stages[0][2] == 1
+            assert private == []
+            assert public == [
+                protocoltype.id for protocoltype in ProtocolType.query.all()
+                if protocoltype.is_public]
+
+    def test_calendar_events(self):
+        past_days = getattr(proto3.config, "FEED_CALENDAR_PAST_DAYS", 365)
+        timezone_map = getattr(proto3.config, "CALENDAR_TIMEZONE_MAP", {})
+        feeds.feed_cache.clear()
+        with proto3.app.app_context():
+            session = proto3.db.session
+            protocoltype = ProtocolType(
+                name="Kalendertest", short_name="kalender",
+                usual_time=time(18, 0), is_public=True,
+                restrict_networks=False, modify_group="", private_group="",
+                public_group="", publish_group="")
+            session.add(protocoltype)
+            session.commit()
+            today = date.today()
+            planned, parsed, old = [
+                Protocol(
+                    protocoltype_id=protocoltype.id, done=False,
+                    date=today + timedelta(days=days), start_time=start_time)
+                for days, start_time in [
+                    (7, None), (14, time(19, 30)), (-10, None)]
+            ]
+            session.add_all([planned, parsed, old])
+            session.commit()
+            session.add_all([
+                DefaultTOP(
+                    protocoltype_id=protocoltype.id, name="Sonstiges",
+                    number=1),
+                DefaultTOP(
+                    protocoltype_id=protocoltype.id, name="Begrüßung",
+                    number=-1),
+                DefaultTOP(
+                    protocoltype_id=protocoltype.id, name="Protokoll",
+                    number=0),
+                TOP(protocol_id=planned.id, name="Haushalt", number=1,
+                    planned=True),
+                TOP(protocol_id=parsed.id, name="Wahlen", number=1,
+                    planned=False),
+            ])
+            session.commit()
+            try:
+                proto3.config.FEED_CALENDAR_PAST_DAYS = 5
+                events = feeds.load_calendar_events(
+                    [protocoltype.id], done=False,
+                    since=feeds.get_calendar_start())
+                assert [event.protocol_id for event in events] == [
+                    parsed.id, planned.id]
+                assert events[0].top_names == ["Wahlen"]
+                assert events[1].top_names == [
+                    "Begrüßung", "Protokoll", "Haushalt", "Sonstiges"]
+                assert events[0].start.time() == time(19, 30)
+                assert events[1].start.time() == time(18, 0)
+                proto3.config.FEED_CALENDAR_PAST_DAYS = 30
+                proto3.config.CALENDAR_TIMEZONE_MAP = {
+                    events[0].start.tzname(): "Europe/Berlin"}
+                response = self.app.get(
+                    "/feed/appointments/ical/{}".format(protocoltype.id))
+            finally:
+                proto3.config.FEED_CALENDAR_PAST_DAYS = past_days
+                proto3.config.CALENDAR_TIMEZONE_MAP = timezone_map
+            assert response.status_code == STATUS_OK
+            calendar = icalendar.Calendar.from_ical(response.data)
+            components = {
+                int(component["uid"]): component
+                for component in calendar.walk("VEVENT")
+            }
+            assert set(components) == set([planned.id, parsed.id, old.id])
+            for component in components.values():
+                assert component["dtstart"].params["TZID"] == "Europe/Berlin"
+            assert str(components[planned.id]["description"]).split(
+                "\n") == ["Begrüßung", "Protokoll", "Haushalt", "Sonstiges"]
+            assert str(components[parsed.id]["description"]) == "Wahlen"
+            assert (components[parsed.id].decoded("dtstart").replace(
+                tzinfo=None) == datetime.combine(parsed.date, time(19, 30)))
+
+    def test_wiki_pushes_are_kept_per_type(self):
+        with proto3.app.app_context():
+            protocoltype, other = ProtocolType.query.limit(2).all()
+            page = protocoltype.get_wiki_infobox_title()
+            assert not WikiPush.is_unchanged(protocoltype, page, "alt")
+            WikiPush.remember(protocoltype, page, "alt")
+            assert WikiPush.is_unchanged(protocoltype, page, "alt")
+            WikiPush.remember(protocoltype, page, "neu")
+            assert not WikiPush.is_unchanged(protocoltype, page, "alt")
+            assert WikiPush.is_unchanged(protocoltype, page, "neu")
+            assert not WikiPush.is_unchanged(other, page, "neu")
+            assert WikiPush.query.filter_by(page=page).count() == 1
+
+    def test_parsed_protocol_depends_on_type(self):
+        with proto3.app.app_context():
+            session = proto3.db.session
+            protocoltype = ProtocolType.query.first()
+            protocol = Protocol(
+                protocoltype_id=protocoltype.id, date=date(2030, 1, 1),
+                source="Quelltext", done=True)
+            session.add(protocol)
+            session.commit()
+            protocol.mark_parsed("parser", "templates")
+            session.commit()
+            assert protocol.is_parsed_unchanged("parser", "templates")
+            assert not protocol.is_parsed_unchanged("parser", "other")
+            session.add(DefaultTOP(
+                protocoltype_id=protocoltype.id, name="Neu", number=5))
+            session.commit()
+            assert not protocol.is_parsed_unchanged("parser", "templates")
+            protocol.mark_parsed("parser", "templates")
+            protocoltype.latex_template = "anders"
+            session.commit()
+            assert not protocol.is_parsed_unchanged("parser", "templates")
+
+    def test_pending_task_register_keeps_session(self):
+        with proto3.app.app_context():
+            session = proto3.db.session
+            protocol = Protocol.query.first()
+            content = protocol.content_public
+            protocol.content_public = "halb geparst"
+            key = PendingTask.make_key("parse", protocol.id)
+            token = PendingTask.register(key)
+            assert protocol in session.dirty
+            session.rollback()
+            assert PendingTask.is_current(key, token)
+            assert Protocol.query.first().content_public == content
+            newer_token = PendingTask.register(key)
+            assert not PendingTask.is_current(key, token)
+            assert PendingTask.is_current(key, newer_token)
+
+    def test_todo_first_protocol(self):
+        with proto3.app.app_context():
+            session = proto3.db.session
+            protocoltype = ProtocolType.query.first()
+            later = Protocol(
+                protocoltype_id=protocoltype.id, date=date(2030, 1, 8))
+            earlier = Protocol(
+                protocoltype_id=protocoltype.id, date=date(2030, 1, 1))
+            todo = Todo(
+                protocoltype_id=protocoltype.id, who="a", description="b",
+                state=TodoState.open)
+            todo.protocols.append(later)
+            orphan = Todo(
+                protocoltype_id=protocoltype.id, who="c", description="d",
+                state=TodoState.open)
+            orphan.protocols.append(earlier)
+            session.add_all([later, earlier, todo, orphan])
+            session.commit()
+            orphan_id = orphan.id
+            assert todo.first_protocol_id == later.id
+            todo.protocols.append(earlier)
+            session.commit()
+            assert todo.get_first_protocol() == earlier
+            assert todo.is_new(earlier) and not todo.is_new(later)
+            assert todo in earlier.get_originating_todos()
+            session.delete(earlier)
+            session.commit()
+            assert session.get(Todo, orphan_id) is None
+            assert todo.protocols == [later]
+            assert todo.first_protocol_id == later.id
+            assert todo.first_protocol_date == date(2030, 1, 8)
+
+    def test_protocol_fragments_follow_changes(self):
+        fragments._backend = MemoryFragmentBackend()
+        with proto3.app.app_context():
+            session = proto3.db.session
+            protocoltype = next(
+                protocoltype for protocoltype in ProtocolType.query.all()
+                if protocoltype.is_public
+                and not protocoltype.restrict_networks)
+            protocol = Protocol(
+                protocoltype_id=protocoltype.id, date=date(2030, 1, 1),
+                public=True, content_html_public="<p>Alter Inhalt</p>")
+            session.add(protocol)
+            session.commit()
+            top = TOP(
+                protocol_id=protocol.id, name="Alter TOP", number=1,
+                planned=True)
+            default_top = DefaultTOP(
+                protocoltype_id=protocoltype.id, name="Alter Standard-TOP",
+                number=1)
+            document = Document(
+                protocol_id=protocol.id, name="alt.pdf", filename="alt.pdf",
+                is_compiled=False, is_extra=False, is_private=False)
+            session.add_all([top, default_top, document])
+            session.commit()
+            localtop = LocalTOP(
+                protocol_id=protocol.id, defaulttop_id=default_top.id)
+            session.add(localtop)
+            session.commit()
+            route = "/protocol/show/{}".format(protocol.id)
+            page = self.app.get(route).get_data(as_text=True)
+            for text in ["Alter Inhalt", "Alter TOP", "Alter Standard-TOP",
+                         "alt.pdf"]:
+                assert text in page
+            changes = [
+                (lambda: setattr(top, "name", "Neuer TOP"),
+                 "Neuer TOP", "Alter TOP"),
+                (lambda: setattr(default_top, "name", "Neuer Standard-TOP"),
+                 "Neuer Standard-TOP", "Alter Standard-TOP"),
+                (lambda: session.delete(localtop),
+                 None, "Neuer Standard-TOP"),
+                (lambda: setattr(document, "name", "neu.pdf"),
+                 "neu.pdf", "alt.pdf"),
+                (lambda: setattr(
+                    protocol, "content_html_public", "<p>Neuer Inhalt</p>"),
+                 "Neuer Inhalt", "Alter Inhalt"),
+            ]
+            for change, added, removed in changes:
+                version = protocol.version
+                change()
+                session.commit()
+                assert protocol.version > version
+                page = self.app.get(route).get_data(as_text=True)
+                assert added is None or added in page
+                assert removed not in page
+
+
+class MailManagerTestCase(unittest.TestCase):
+    class _Handler:
+        def __init__(self):
+            self.mails = []
+            self.peers = set()
+
+        async def handle_RCPT(self, server, session, envelope, address,
+                              rcpt_options):
+            if address.startswith("unknown"):
+                return "550 unknown user"
+            envelope.rcpt_tos.append(address)
+            return "250 OK"
+
+        async def handle_DATA(self, server, session, envelope):
+            self.mails.append(envelope.rcpt_tos)
+            self.peers.add(session.peer)
+            return "250 OK"
+
+    def setUp(self):
+        try:
+            from aiosmtpd.controller import Controller
+        except ImportError:
+            self.skipTest("aiosmtpd is not installed")
+        # the controller connects to its own port on start, so it cannot
+        # bind to port 0 itself
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        self.handler = self._Handler()
+        self.controller = Controller(
+            self.handler, hostname="127.0.0.1", port=port)
+        self.controller.start()
+        mail_config = Config()
+        mail_config.MAIL_ACTIVE = True
+        mail_config.MAIL_FROM = "protokolle@example.com"
+        mail_config.MAIL_HOST = "127.0.0.1:{}".format(port)
+        mail_config.MAIL_USE_TLS = False
+        self.mail_manager = MailManager(mail_config)
+
+    def tearDown(self):
+        self.mail_manager.close_pool()
+        self.controller.stop()
+
+    def test_send_reuses_connection(self):
+        for _ in range(3):
+            self.mail_manager.send("a@example.com", "Subject", "Content")
+        assert len(self.handler.mails) == 3
+        assert len(self.handler.peers) == 1
+
+    def test_send_batch_reports_failures(self):
+        mails = [
+            (to_addr, "Subject", "Content", None, None)
+            for to_addr in (
+                "a@example.com", "unknown@example.com", "b@example.com")
+        ]
+        failures = self.mail_manager.send_batch(mails)
+        assert [to_addr for to_addr, _ in failures] == ["unknown@example.com"]
+        assert len(self.handler.mails) == 2
+        assert len(self.handler.peers) == 1
+
+
+class WikiClientTestCase(unittest.TestCase):
+    class _Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self._answer()
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            self.rfile.read(length)
+            self._answer()
+
+        def _answer(self):
+            wiki = self.server.wiki
+            params = {
+                key: values[0] for key, values
+                in parse_qs(urlparse(self.path).query,
+                            keep_blank_values=True).items()
+            }
+            action = params["action"]
+            wiki.actions.append(action)
+            wiki.ports.add(self.client_address[1])
+            if action == "login":
+                if "lgtoken" not in params:
+                    answer = {"login": {"result": "NeedToken",
+                                        "token": "login-token"}}
+                else:
+                    answer = {"login": {"result": "Success"}}
+            elif action == "query":
+                answer = {"query": {"pages": {"1": {
+                    "title": params["titles"],
+                    "edittoken": wiki.edit_token}}}}
+            elif action == "edit":
+                if params.get("token") != wiki.edit_token:
+                    answer = {"error": {"code": "badtoken",
+                                        "info": "Invalid token"}}
+                else:
+                    answer = {"edit": {"result": "Success"}}
+            else:
+                answer = {}
+            body = json.dumps(answer).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._Handler)
+        self.server.wiki = self
+        self.actions = []
+        self.ports = set()
+        self.edit_token = "edit-token"
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.client = WikiClient(
+            active=True,
+            endpoint="http://127.0.0.1:{}/api.php".format(
+                self.server.server_address[1]),
+            anonymous=False, user="proto3", password="secret", domain="")
+
+    def tearDown(self):
+        self.client.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_edit_reuses_session_and_token(self):
+        self.client.edit_page(title="A", content="a", summary="test")
+        self.client.edit_page(title="B", content="b", summary="test")
+        assert self.actions.count("login") == 2
+        assert self.actions.count("query") == 1
+        assert self.actions.count("edit") == 2
+        assert len(self.ports) == 1
+
+    def test_edit_refreshes_bad_token(self):
+        self.client.edit_page(title="A", content="a", summary="test")
+        self.edit_token = "new-edit-token"
+        self.client.edit_page(title="B", content="b", summary="test")
+        assert self.actions.count("login") == 4
+        assert self.actions.count("query") == 2
+        assert self.actions[-1] == "edit"
+        assert self.client.edit_token == "new-edit-token"
+
+
+class StageTimerTestCase(unittest.TestCase):
+    def test_counts_queries_per_stage(self):
+        from sqlalchemy import create_engine, text
+        engine = create_engine("sqlite://")
+        with StageTimer(engine) as timer:
+            timer.start("first")
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+                connection.execute(text("SELECT 2"))
+            timer.start("second")
+        assert [(name, queries) for name, _, queries in timer.stages] == [
+            ("first", 2), ("second", 0)]
+
+
+class MetricsTestCase(unittest.TestCase):
+    def test_render_histogram_and_counter(self):
+        registry = Registry()
+        histogram = registry.histogram(
+            "test_duration_seconds", "Test durations.", ["result"],
+            buckets=(0.1, 1))
+        counter = registry.counter("test_total", "Test count.", ["kind"])
+        histogram.observe(0.05, result="ok")
+        histogram.observe(0.5, result="ok")
+        counter.inc(kind="a\"b")
+        with self.assertRaises(ValueError):
+            with histogram.time():
+                raise ValueError()
+        lines = render_metrics([("web-1", registry.collect())]).splitlines()
+        assert "# TYPE test_duration_seconds histogram" in lines
+        assert ('test_duration_seconds_bucket{process="web-1",result="ok",'
+                'le="1.0"} 2.0') in lines
+        assert ('test_duration_seconds_count{process="web-1",'
+                'result="error"} 1.0') in lines
+        assert 'test_total{process="web-1",kind="a\\"b"} 1.0' in lines
+
+
+
+class ProtocolTypeRightsTestCase(unittest.TestCase):
+    class User:
+        def __init__(self, username, groups):
+            self.username = username
+            self.groups = groups
+
+    def test_rights_are_computed_once_per_request(self):
+        protocoltype = ProtocolType(
+            id=1, is_public=False, public_group="", private_group="fs",
+            modify_group="fs", publish_group="", restrict_networks=False)
+        member = self.User("member", ["fs"])
+        other = self.User("other", [])
+        with proto3.app.test_request_context():
+            assert protocoltype.has_private_view_right(member)
+            assert protocoltype.has_modify_right(member)
+            assert not protocoltype.has_publish_right(member)
+            assert not protocoltype.has_public_view_right(other)
+            protocoltype.private_group = "other"
+            assert protocoltype.has_private_view_right(member)
+        with proto3.app.test_request_context():
+            assert not protocoltype.has_private_view_right(member)
+
+class CurrentUserTestCase(unittest.TestCase):
+    def test_user_is_checked_once_per_request(self):
+        import shared
+        from flask import session
+        checked = []
+        def check_user(hashstring):
+            checked.append(hashstring)
+            return False
+        security_manager = shared.security_manager
+        security_manager.check_user, original = (
+            check_user, security_manager.check_user)
+        try:
+            with proto3.app.test_request_context():
+                session["auth"] = "first"
+                for _ in range(3):
+                    assert shared.current_user() is None
+                    assert not shared.check_auth("first")
+                assert checked == ["first"]
+                session["auth"] = "second"
+                assert shared.current_user() is None
+                assert checked == ["first", "second"]
+                session.pop("auth")
+                assert shared.current_user() is None
+                assert checked == ["first", "second"]
+            with proto3.app.test_request_context():
+                session["auth"] = "first"
+                assert shared.current_user() is None
+                assert checked == ["first", "second", "first"]
+        finally:
+            security_manager.check_user = original
+
+class FeedCacheTestCase(unittest.TestCase):
+    def test_conditional_requests(self):
+        rendered = []
+        def render():
+            rendered.append(len(rendered))
+            return "feed {}".format(len(rendered)).encode("utf-8")
+        def request_feed(headers=None):
+            with proto3.app.test_request_context(headers=headers):
+                return feeds.make_response(
+                    "test", [protocoltype], "text/plain", render)
+        feeds.feed_cache.clear()
+        protocoltype = ProtocolType(id=1)
+        response = request_feed()
+        assert response.status_code == 200
+        etag, _ = response.get_etag()
+        assert response.last_modified is not None
+        conditional = {"If-None-Match": '"{}"'.format(etag)}
+        assert request_feed(conditional).status_code == 304
+        feeds.feed_cache.invalidate([2])
+        assert request_feed(conditional).status_code == 304
+        assert len(rendered) == 1
+        feeds.feed_cache.invalidate([1])
+        assert request_feed(conditional).status_code == 200
+        assert len(rendered) == 2
+
+    def test_rebuilt_feed_keeps_date(self):
+        cache = feeds.FeedCache()
+        key = ("http://localhost/", "test", (1,))
+        timeout = getattr(proto3.config, "FEED_CACHE_TIMEOUT", 300)
+        proto3.config.FEED_CACHE_TIMEOUT = -1
+        try:
+            feed = cache.put(key, b"feed")
+            assert cache.get(key) is None
+            rebuilt = cache.put(key, b"feed")
+            assert rebuilt.last_modified == feed.last_modified
+            cache.invalidate([1])
+            assert cache.get(key) is None
+            assert not cache._feeds
+        finally:
+            proto3.config.FEED_CACHE_TIMEOUT = timeout
+
+    def test_evicts_least_recently_used(self):
+        cache = feeds.FeedCache(size=2)
+        keys = [("http://{}/".format(host), "test", (1,))
+                for host in ["a", "b", "c"]]
+        cache.put(keys[0], b"a")
+        cache.put(keys[1], b"b")
+        assert cache.get(keys[0]).content == b"a"
+        cache.put(keys[2], b"c")
+        assert cache.get(keys[1]) is None
+        assert cache.get(keys[0]).content == b"a"
+        assert cache.get(keys[2]).content == b"c"
+        assert len(cache._feeds) == 2
+
+class MemoryFragmentBackendTestCase(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        backend = MemoryFragmentBackend(size=2)
+        backend.set("a", "<p>a</p>", 60)
+        backend.set("b", "<p>b</p>", 60)
+        assert backend.get("a") == "<p>a</p>"
+        backend.set("c", "<p>c</p>", 60)
+        assert backend.get("b") is None
+        assert backend.get("a") == "<p>a</p>"
+        assert backend.get("c") == "<p>c</p>"
+
+    def test_expires(self):
+        backend = MemoryFragmentBackend()
+        backend.set("a", "<p>a</p>", -1)
+        assert backend.get("a") is None
+
+class NetworkAllowlistTestCase(unittest.TestCase):
+    def test_contains(self):
+        from ipaddress import ip_address
+        allowlist = NetworkAllowlist(
+            "10.0.0.0/24, 10.0.1.0/24,192.168.1.7, 2001:db8::/32, x, 1.2.3.4")
+        assert ip_address("10.0.0.5") in allowlist
+        assert ip_address("10.0.1.255") in allowlist
+        assert ip_address("10.0.2.0") not in allowlist
+        assert ip_address("192.168.1.7") in allowlist
+        assert ip_address("192.168.1.8") not in allowlist
+        assert ip_address("2001:db8::1") in allowlist
+        assert ip_address("1.2.3.4") not in allowlist
+        assert ip_address("10.0.0.1") not in NetworkAllowlist(None)
+
+class SearchQueryTestCase(unittest.TestCase):
+    def test_quoted_terms_are_phrases(self):
+        terms = ["Haushalt", "neue Satzung", "?"]
+        assert (PostgresSearchBackend.make_tsquery(terms)
+                == "('haushalt':*) & ('neue' <-> 'satzung':*)")
+        assert (SqliteSearchBackend.make_match(terms)
+                == '"haushalt"* "neue satzung"*')
+
+    def test_highlighter_escapes_and_prefers_longer_terms(self):
+        highlighter = Highlighter(["haus", "Haushalt", "<b>"])
+        snippet = highlighter.make_snippet(
+            "Nichts\nDer Haushalt <b> im Haus")
+        assert snippet == (
+            "Der <b>Haushalt</b> <b>&lt;b&gt;</b> im <b>Haus</b>")
+
+class _SearchBackendTests:
+    backend_class = None
+
+    def setUp(self):
+        self._general_setup()
+        self._create_tempdir()
+        self._create_db("full")
+        with proto3.app.app_context():
+            connection = proto3.db.session.connection()
+            if not self.backend_class.is_available(connection):
+                self._general_teardown()
+                self.skipTest("{} search is not available".format(
+                    self.backend_class.name))
+            search._backends[connection.dialect.name] = self.backend_class()
+
+    def tearDown(self):
+        search._backends.clear()
+        self._general_teardown()
+
+    def _find(self, kind, search_term, fields):
+        return [
+            result.object_id for result in search.find(
+                proto3.db.session, kind, search_term, fields)
+        ]
+
+    def test_protocols(self):
+        with proto3.app.app_context():
+            session = proto3.db.session
+            protocoltype = ProtocolType.query.first()
+            short = Protocol(
+                protocoltype_id=protocoltype.id, date=date(2030, 1, 1),
+                content_public="Zwiebelkuchen und Zwiebelkuchen",
+                content_private="Zwiebelkuchen und Zwiebelkuchen")
+            long = Protocol(
+                protocoltype_id=protocoltype.id, date=date(2030, 1, 8),
+                content_public="Zwiebelkuchen " + "Sonstiges " * 50,
+                content_private="Geheimrezept")
+            session.add_all([short, long])
+            session.commit()
+            assert self._find(
+                search.KIND_PROTOCOL, "zwiebel", ["public"]
+            ) == [short.id, long.id]
+            assert self._find(
+                search.KIND_PROTOCOL, "geheimrezept", ["public"]) == []
+            assert self._find(
+                search.KIND_PROTOCOL, "geheimrezept", ["private"]
+            ) == [long.id]
+            short.content_public = "Apfelkuchen"
+            session.commit()
+            assert self._find(
+                search.KIND_PROTOCOL, "zwiebelkuchen", ["public"]
+            ) == [long.id]
+            assert self._find(
+                search.KIND_PROTOCOL, "apfelkuchen", ["public"]
+            ) == [short.id]
+            session.delete(long)
+            session.commit()
+            assert self._find(
+                search.KIND_PROTOCOL, "zwiebelkuchen", ["public"]) == []
+
+    def test_limit_applies_to_allowed(self):
+        max_results = getattr(proto3.config, "SEARCH_MAX_RESULTS", 1000)
+        with proto3.app.app_context():
+            session = proto3.db.session
+            protocoltype = ProtocolType.query.first()
+            hidden = Protocol(
+                protocoltype_id=protocoltype.id, date=date(2030, 1, 1),
+                content_public="Zwiebelkuchen und Zwiebelkuchen")
+            visible = Protocol(
+                protocoltype_id=protocoltype.id, date=date(2030, 1, 8),
+                content_public="Zwiebelkuchen " + "Sonstiges " * 50,
+                public=True)
+            session.add_all([hidden, visible])
+            session.commit()
+            allowed = select(Protocol.id).where(Protocol.public.is_(True))
+            try:
+                proto3.config.SEARCH_MAX_RESULTS = 1
+                results = search.find(
+                    session, search.KIND_PROTOCOL, "zwiebelkuchen",
+                    ["public"], allowed)
+            finally:
+                proto3.config.SEARCH_MAX_RESULTS = max_results
+            assert [result.object_id for result in results] == [visible.id]
+
+    def test_todos_and_decisions(self):
+        with proto3.app.app_context():
+            session = proto3.db.session
+            protocol = Protocol.query.first()
+            todo = Todo(
+                protocoltype_id=protocol.protocoltype_id, who="Zwiebelbauer",
+                description="Zwiebelkuchen backen", state=TodoState.open)
+            decision = Decision(
+                protocol_id=protocol.id,
+                content="Der Zwiebelkuchen wird gekauft")
+            session.add_all([todo, decision])
+            session.commit()
+            assert self._find(
+                search.KIND_TODO, "zwiebelbauer", ["content"]) == [todo.id]
+            assert self._find(
+                search.KIND_TODO, '"zwiebelkuchen back"', ["content"]
+            ) == [todo.id]
+            assert self._find(
+                search.KIND_TODO, '"backen zwiebelkuchen"', ["content"]
+            ) == []
+            assert self._find(
+                search.KIND_DECISION, "zwiebelkuchen gekauft", ["content"]
+            ) == [decision.id]
+            todo.description = "Apfelkuchen backen"
+            session.delete(decision)
+            session.commit()
+            assert self._find(
+                search.KIND_TODO, "zwiebelkuchen", ["content"]) == []
+            assert self._find(
+                search.KIND_TODO, "zwiebelbauer apfel", ["content"]
+            ) == [todo.id]
+            assert self._find(
+                search.KIND_DECISION, "zwiebelkuchen", ["content"]) == []
+
+class SqliteSearchBackendTestCase(_SearchBackendTests, GeneralTestCase):
+    backend_class = SqliteSearchBackend
+
+class PythonSearchBackendTestCase(_SearchBackendTests, GeneralTestCase):
+    backend_class = PythonSearchBackend
+
 if __name__ == "__main__":
     unittest.main()
@@ -11,14 +11,25 @@ from datetime import datetime
 import requests
 from io import BytesIO
 import ipaddress
+import functools
+from bisect import bisect_right
 from socket import getfqdn
 from uuid import uuid4
 import subprocess
 import contextlib
+import threading
+import time
+
+from sqlalchemy import event
 
 from etherpad_lite import EtherpadLiteClient as EtherpadClient
 
 from shared import config
+from metrics import MAIL_DURATION
+
+SMTP_STATUS_OK = 250
+SMTP_ANSWERED_ERRORS = (
+    smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException)
 
 
 def random_string(length):
@@ -61,6 +72,10 @@ class MailManager:
         self.password = getattr(config, "MAIL_PASSWORD", "")
         self.use_tls = getattr(config, "MAIL_USE_TLS", True)
         self.use_starttls = getattr(config, "MAIL_USE_STARTTLS", False)
+        self.idle_timeout = getattr(config, "MAIL_IDLE_TIMEOUT", 60)
+        self.pool_size = getattr(config, "MAIL_POOL_SIZE", 1)
+        self._pool = []
+        self._pool_lock = threading.Lock()
 
     def _get_smtp(self):
         if self.use_tls:
@@ -81,11 +96,63 @@ class MailManager:
         yield server
         server.quit()
 
-    def send(self, to_addr, subject, content, appendix=None, reply_to=None):
-        if (not self.active
-                or not self.hostname
-                or not self.from_addr):
-            return
+    @staticmethod
+    def _close(server):
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def _acquire(self):
+        """Return a pooled connection that is still alive or a new one."""
+        while True:
+            with self._pool_lock:
+                if not self._pool:
+                    break
+                server, last_used = self._pool.pop()
+            if time.monotonic() - last_used > self.idle_timeout:
+                self._close(server)
+                continue
+            try:
+                if server.noop()[0] == SMTP_STATUS_OK:
+                    return server
+            except (smtplib.SMTPException, OSError):
+                pass
+            server.close()
+        return self.connect()
+
+    def _release(self, server):
+        with self._pool_lock:
+            if len(self._pool) < self.pool_size:
+                self._pool.append((server, time.monotonic()))
+                return
+        self._close(server)
+
+    @contextlib.contextmanager
+    def pooled_session(self):
+        server = self._acquire()
+        try:
+            yield server
+        except SMTP_ANSWERED_ERRORS:
+            # the server answered, so the connection is still usable
+            self._release(server)
+            raise
+        except Exception:
+            server.close()
+            raise
+        self._release(server)
+
+    def close_pool(self):
+        with self._pool_lock:
+            pool, self._pool = self._pool, []
+        for server, _ in pool:
+            self._close(server)
+
+    def _is_usable(self):
+        return self.active and self.hostname and self.from_addr
+
+    def _make_message(self, to_addr, subject, content, appendix=None,
+                      reply_to=None):
         msg = MIMEMultipart("mixed")
         msg["From"] = self.from_addr
         msg["To"] = to_addr
@@ -100,11 +167,54 @@ class MailManager:
                 part["Content-Disposition"] = (
                     'attachment; filename="{}"'.format(name))
                 msg.attach(part)
-        with self.session() as server:
+        return msg
+
+    def _sendmail(self, server, to_addr, msg):
+        with MAIL_DURATION.time():
             server.sendmail(
-                self.from_addr,
-                to_addr.split(","),
-                msg.as_string())
+                self.from_addr, to_addr.split(","), msg.as_string())
+
+    def send(self, to_addr, subject, content, appendix=None, reply_to=None):
+        if not self._is_usable():
+            return
+        msg = self._make_message(to_addr, subject, content, appendix, reply_to)
+        try:
+            with self.pooled_session() as server:
+                self._sendmail(server, to_addr, msg)
+        except smtplib.SMTPServerDisconnected:
+            # the pooled connection died between the check and the send
+            with self.pooled_session() as server:
+                self._sendmail(server, to_addr, msg)
+
+    def send_batch(self, mails):
+        """Send several mails over one connection.
+
+        mails is a list of (to_addr, subject, content, appendix, reply_to).
+        Returns a list of (to_addr, exception) for all failed mails.
+        """
+        if not self._is_usable():
+            return []
+        failures = []
+        pending = list(mails)
+        while pending:
+            try:
+                with self.pooled_session() as server:
+                    while pending:
+                        to_addr, subject, content, appendix, reply_to = (
+                            pending[0])
+                        try:
+                            self._sendmail(server, to_addr, self._make_message(
+                                to_addr, subject, content, appendix,
+                                reply_to))
+                        except SMTP_ANSWERED_ERRORS as exc:
+                            failures.append((to_addr, exc))
+                        pending.pop(0)
+            except (smtplib.SMTPException, OSError) as exc:
+                # connection lost: the current mail failed, retry the rest
+                # over a fresh connection
+                to_addr = pending.pop(0)[0]
+                failures.append((to_addr, exc))
+        return failures
 
     def check(self):
         if not self.active:
@@ -119,6 +229,73 @@ class MailManager:
 mail_manager = MailManager(config)
 
 
+class StageTimer:
+    """Measures duration and database queries of consecutive stages."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.stages = []
+        self._name = None
+        self._start = None
+        self._queries = 0
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._count_query)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+        event.remove(self.engine, "before_cursor_execute", self._count_query)
+
+    def _count_query(self, *args):
+        self._queries += 1
+
+    def start(self, name):
+        self.stop()
+        self._name = name
+        self._start = time.perf_counter()
+        self._queries = 0
+
+    def stop(self):
+        if self._name is None:
+            return
+        self.stages.append(
+            (self._name, time.perf_counter() - self._start, self._queries))
+        self._name = None
+
+
+class QueryProfiler:
+    """Counts and times the SQL statements of one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = {}
+        self._start = None
+
+    def before_execute(self, statement):
+        self._start = time.perf_counter()
+
+    def after_execute(self, statement):
+        duration = 0.0
+        if self._start is not None:
+            duration = time.perf_counter() - self._start
+            self._start = None
+        self.count += 1
+        self.duration += duration
+        count, total = self.statements.get(statement, (0, 0.0))
+        self.statements[statement] = (count + 1, total + duration)
+
+    def get_repeated(self, threshold):
+        """Lists (statement, count, duration) of statements run at least
+        threshold times, which usually are lazy loads in a loop."""
+        return sorted(
+            ((statement, count, duration)
+             for statement, (count, duration) in self.statements.items()
+             if count >= threshold),
+            key=lambda entry: entry[1], reverse=True)
+
+
 def get_first_unused_int(numbers):
     positive_numbers = [number for number in numbers if number >= 0]
     if len(positive_numbers) == 0:
@@ -224,16 +401,50 @@ def get_current_ip():
     return address
 
 
+class NetworkAllowlist:
+    """Comma separated networks as sorted address intervals per IP version.
+
+    Parsing stops at the first invalid network, the networks after it are
+    not allowed.
+    """
+
+    def __init__(self, networks_string):
+        intervals = {4: [], 6: []}
+        for network_string in (networks_string or "").split(","):
+            try:
+                network = ipaddress.ip_network(network_string.strip())
+            except ValueError:
+                break
+            intervals[network.version].append((
+                int(network.network_address),
+                int(network.broadcast_address)))
+        self.starts = {}
+        self.ends = {}
+        for version, version_intervals in intervals.items():
+            starts, ends = [], []
+            for start, end in sorted(version_intervals):
+                if ends and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+            self.starts[version] = starts
+            self.ends[version] = ends
+
+    def __contains__(self, address):
+        value = int(address)
+        index = bisect_right(self.starts[address.version], value) - 1
+        return index >= 0 and value <= self.ends[address.version][index]
+
+
+@functools.lru_cache(maxsize=256)
+def get_network_allowlist(networks_string):
+    # keyed by the string, an edited protocoltype gets a new entry
+    return NetworkAllowlist(networks_string)
+
+
 def check_ip_in_networks(networks_string):
-    address = get_current_ip()
-    try:
-        for network_string in networks_string.split(","):
-            network = ipaddress.ip_network(network_string.strip())
-            if address in network:
-                return True
-        return False
-    except ValueError:
-        return False
+    return get_current_ip() in get_network_allowlist(networks_string)
 
 
 def fancy_join(values, sep1=" und ", sep2=", "):
@@ -279,8 +490,7 @@ def get_git_revision():
         pass
 
 
-def get_max_page_length_exp(objects):
-    length = len(objects)
+def get_max_page_length_exp(length):
     if length > 0:
         return math.ceil(math.log10(length))
     return 1
@@ -462,6 +462,21 @@ class ErrorsTable(Table):
         ]
 
 
+class ParseTimingsTable(Table):
+    def __init__(self, timings):
+        super().__init__("Laufzeiten der letzten Kompilierung", timings)
+
+    def headers(self):
+        return ["Schritt", "Dauer", "Datenbankanfragen"]
+
+    def row(self, timing):
+        return [
+            timing.stage,
+            "{:.0f} ms".format(timing.duration * 1000),
+            timing.queries,
+        ]
+
+
 class ErrorTable(SingleValueTable):
     def __init__(self, error):
         super().__init__(error.action, error)
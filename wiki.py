@@ -5,12 +5,17 @@ from shared import config
 
 HTTP_STATUS_OK = 200
 HTTP_STATUS_AUTHENTICATE = 401
+ERROR_BAD_TOKEN = "badtoken"
 
 
 class WikiException(Exception):
     pass
 
 
+class BadTokenException(WikiException):
+    pass
+
+
 def _filter_params(params):
     result = {}
     for key, value in sorted(params.items(), key=lambda t: t[0] == "token"):
@@ -25,22 +30,24 @@ def _filter_params(params):
 class WikiClient:
     def __init__(self, active=None, endpoint=None, anonymous=None, user=None,
                  password=None, domain=None):
-        def _or_default(value, default):
+        def _or_default(value, key):
             if value is None:
-                return default
+                return getattr(config, key)
             return value
-        self.active = _or_default(active, config.WIKI_ACTIVE)
-        self.endpoint = _or_default(endpoint, config.WIKI_API_URL)
-        self.anonymous = _or_default(anonymous, config.WIKI_ANONYMOUS)
-        self.user = _or_default(user, config.WIKI_USER)
-        self.password = _or_default(password, config.WIKI_PASSWORD)
-        self.domain = _or_default(domain, config.WIKI_DOMAIN)
-        self.token = None
-        self.cookies = requests.cookies.RequestsCookieJar()
+        self.active = _or_default(active, "WIKI_ACTIVE")
+        self.endpoint = _or_default(endpoint, "WIKI_API_URL")
+        self.anonymous = _or_default(anonymous, "WIKI_ANONYMOUS")
+        self.user = _or_default(user, "WIKI_USER")
+        self.password = _or_default(password, "WIKI_PASSWORD")
+        self.domain = _or_default(domain, "WIKI_DOMAIN")
+        self.logged_in = False
+        self.edit_token = None
+        self.session = requests.Session()
+        self.session.auth = requests.auth.HTTPBasicAuth(
+            self.user, self.password)
 
     def __enter__(self):
-        if not self.anonymous:
-            self.login()
+        self.ensure_login()
         return self
 
     def __exit__(self, type, value, traceback):
@@ -48,7 +55,11 @@ class WikiClient:
             self.logout()
 
     def is_logged_in(self):
-        return self.token is not None
+        return self.logged_in
+
+    def ensure_login(self):
+        if not self.anonymous and not self.logged_in:
+            self.login()
 
     def login(self):
         if not self.active:
@@ -65,16 +76,19 @@ class WikiClient:
                 or "result" not in login_answer["login"]
                 or login_answer["login"]["result"] != "Success"):
             raise WikiException("Login not successful.")
+        self.logged_in = True
 
     def logout(self):
         if not self.active:
             return
         self.do_action("logout")
+        self.logged_in = False
+        self.edit_token = None
+        self.session.cookies.clear()
 
-    def edit_page(self, title, content, summary, recreate=True,
-                  createonly=False):
-        if not self.active:
-            return
+    def get_edit_token(self, title):
+        if self.edit_token is not None:
+            return self.edit_token
         # todo: port to new api once the wiki is updated
         prop_answer = self.do_action(
             "query", method="get", prop="info", intoken="edit", titles=title)
@@ -82,18 +96,33 @@ class WikiClient:
                 or "pages" not in prop_answer["query"]):
             raise WikiException("Can't get token for page {}".format(title))
         pages = prop_answer["query"]["pages"]
-        edit_token = None
         for page in pages.values():
             if page["title"] == title:
-                edit_token = page["edittoken"]
-                break
-        if edit_token is None:
-            raise WikiException("Can't get token for page {}".format(title))
-        self.do_action(
-            action="edit", method="post", data={"text": content},
-            token=edit_token, title=title,
-            summary=summary, recreate=recreate,
-            createonly=createonly, bot=True)
+                self.edit_token = page["edittoken"]
+                return self.edit_token
+        raise WikiException("Can't get token for page {}".format(title))
+
+    def edit_page(self, title, content, summary, recreate=True,
+                  createonly=False):
+        if not self.active:
+            return
+
+        def _edit():
+            self.do_action(
+                action="edit", method="post", data={"text": content},
+                token=self.get_edit_token(title), title=title,
+                summary=summary, recreate=recreate,
+                createonly=createonly, bot=True)
+        self.ensure_login()
+        try:
+            _edit()
+        except BadTokenException:
+            # the session or the token expired, start a fresh one
+            self.logged_in = False
+            self.edit_token = None
+            self.session.cookies.clear()
+            self.ensure_login()
+            _edit()
 
     def do_action(self, action, method="get", data=None, **kwargs):
         if not self.active:
@@ -104,24 +133,41 @@ class WikiClient:
 
         def _do_request():
             if method == "get":
-                return requests.get(
-                    self.endpoint, cookies=self.cookies, params=params,
-                    auth=requests.auth.HTTPBasicAuth(self.user, self.password))
+                return self.session.get(self.endpoint, params=params)
             elif method == "post":
-                return requests.post(
-                    self.endpoint, cookies=self.cookies, data=data,
-                    params=params, auth=requests.auth.HTTPBasicAuth(
-                        self.user, self.password))
+                return self.session.post(
+                    self.endpoint, data=data, params=params)
         req = _do_request()
         if req.status_code != HTTP_STATUS_OK:
             raise WikiException(
                 "HTTP status code {} on action {}.".format(
                     req.status_code, action))
-        self.cookies.update(req.cookies)
         try:
-            return req.json()
+            answer = req.json()
         except JSONDecodeError:
             raise WikiException("Server did not return valid JSON.")
+        if isinstance(answer, dict) and "error" in answer:
+            error = answer["error"]
+            if error.get("code") == ERROR_BAD_TOKEN:
+                raise BadTokenException(error.get("info", ERROR_BAD_TOKEN))
+            raise WikiException("Error {} on action {}: {}".format(
+                error.get("code"), action, error.get("info")))
+        return answer
+
+
+_wiki_client = None
+
+
+def get_wiki_client():
+    """Return the wiki client of this worker process.
+
+    Its HTTP connection, login cookies and edit token are reused
+    between pushes.
+    """
+    global _wiki_client
+    if _wiki_client is None:
+        _wiki_client = WikiClient()
+    return _wiki_client
 
 
 def main():